@@ -13,5 +13,8 @@ class KlassAdmin(admin.ModelAdmin):
     list_display = ('course', 'semester')
     search_fields = ('course__department_abbr', 'course__coursenumber', 'semester', )
 
+    def queryset(self, request):
+        return super(KlassAdmin, self).queryset(request).for_display()
+
 
 
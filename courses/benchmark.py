@@ -0,0 +1,278 @@
+"""
+Micro-benchmarks for the courses search hot paths.
+
+The benchmarks that need data generate a synthetic catalog inside a
+transaction that is rolled back afterwards, so they leave the database as
+they found it.  Run them against a scratch database anyway.
+
+bench_suite times every search and autocomplete path over a synthetic
+schedule and returns plain dicts, so its JSON output (see the
+benchmark_courses command) can be compared between runs.
+"""
+import random
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.urlresolvers import clear_url_caches
+from django.db import connection, transaction
+
+from courses.slowlog import explain_sql
+
+__all__ = ["PARSE_QUERY_CORPUS", "time_calls", "bench_parse_query", "rolled_back", "make_catalog", "explain",
+           "bench_normalized_lookups", "make_schedule", "measure", "bench_suite"]
+
+# queries in the forms users type into the course autocomplete
+PARSE_QUERY_CORPUS = (
+    "CS 61A", "cs61a", "CS61B", "cs 61c", "CS 70", "CS 188", "CS C149", "cs162", "CSC61A", "compsci 61a",
+    "EE 20N", "ee40", "EL ENG 105", "eleng 20", "EE C128", "E 7", "engin 7", "ENGIN 45", "ENG 117",
+    "Math 1A", "math 53", "MATH 54", "math h54", "Phys 7A", "phys. 7b", "PHYSICS 137A", "physics 7C",
+    "MCB 32", "mcb c100a", "IB 131", "Chem 1A", "CHEM 3B", "Stat 134", "stats 20", "Econ 1", "econ 100a",
+    "UGBA 10", "BA 10", "POL SCI 1", "PS 2", "hist 7b", "Ling 100", "COGSCI 1", "IEOR 172", "ME C85",
+    "ME 40", "MSE 45", "CE 11", "CIVIL ENGINEERING 60", "BIOE 10", "Astro C10", "Envir Econ & Policy C1",
+    "CS", "ee", "math", "phys", "MCB", "ENG",
+)
+
+def time_calls(func, args, repeat=1000):
+    """ Calls func on every element of args, repeat times; returns the mean seconds per call """
+    start = default_timer()
+    for i in xrange(repeat):
+        for arg in args:
+            func(arg)
+    return (default_timer() - start) / (repeat * len(args))
+
+def bench_parse_query(corpus=PARSE_QUERY_CORPUS, repeat=1000):
+    """
+    Compares Course parse_query (trie resolver) with the regex cascade it replaced, and times the memoized
+    parse_query from an empty cache, with the hits and misses of its LRU cache over the run.
+    """
+    from courses.models import Course
+    from courses.resolver import get_department_resolver
+    get_department_resolver()
+    regex = time_calls(Course.QuerySet.parse_query_regex, corpus, repeat)
+    resolver = time_calls(Course.QuerySet.parse_query.uncached, corpus, repeat)
+    parse_query = Course.QuerySet.parse_query
+    parse_query.cache_clear()
+    before = parse_query.cache_info()
+    memoized = time_calls(parse_query, corpus, repeat)
+    after = parse_query.cache_info()
+    return {
+        "queries": len(corpus),
+        "regex_us": regex * 1e6,
+        "resolver_us": resolver * 1e6,
+        "speedup": regex / resolver,
+        "memoized_us": memoized * 1e6,
+        "memoized_hits": after["hits"] - before["hits"],
+        "memoized_misses": after["misses"] - before["misses"],
+    }
+
+def rolled_back(func, *args, **kwargs):
+    """ Calls func inside a transaction that is always rolled back; func must not commit, as commit_on_success does """
+    transaction.enter_transaction_management()
+    transaction.managed(True)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        transaction.rollback()
+        transaction.leave_transaction_management()
+
+def make_catalog(departments=50, courses=5000):
+    """ Creates departments D000, D001... with courses 1A, 1B, 1C, 1D, 2A... spread evenly over them """
+    from courses.models import Department, Course, normalize_search
+    from courses.importer import bulk_create
+    depts = []
+    for i in range(departments):
+        dept = Department(name="Department %d" % i, abbr="D%03d" % i, hidden=False)
+        dept.search_name = normalize_search(dept.name)
+        depts.append(dept)
+    bulk_create(Department, depts)
+    depts = list(Department.all.filter(abbr__in=[d.abbr for d in depts]))
+    objects = []
+    for i in range(courses):
+        dept = depts[i % departments]
+        j = i // departments
+        course = Course(department=dept, department_abbr=dept.abbr, coursenumber="%d%s" % (j // 4 + 1, "ABCD"[j % 4]),
+                        name="Course %d" % i, description="")
+        course.fill_derived_fields()
+        objects.append(course)
+    bulk_create(Course, objects)
+    return depts
+
+def explain(queryset):
+    """ Returns the database's query plan for queryset as a list of rows """
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    return explain_sql(sql, params, queryset.db)
+
+def _bench_normalized_lookups(courses, repeat):
+    from courses.models import Course
+    make_catalog(courses=courses)
+    lookups = (
+        ("query_exact",
+         lambda: Course.objects.filter(department_abbr__iexact="D007", coursenumber__iexact="12B"),
+         lambda: Course.objects.query_exact("D007", "12B")),
+        ("ft_query",
+         lambda: Course.objects.filter(department_abbr__iexact="D007", number__istartswith="12"),
+         lambda: Course.objects.filter(search_department_abbr="D007", search_number__startswith="12")),
+    )
+    result = {"courses": courses}
+    for name, before, after in lookups:
+        result[name] = {
+            "before_plan": explain(before()),
+            "after_plan": explain(after()),
+            "before_ms": time_calls(lambda f: list(f()), (before,), repeat) * 1e3,
+            "after_ms": time_calls(lambda f: list(f()), (after,), repeat) * 1e3,
+        }
+    return result
+
+def bench_normalized_lookups(courses=100000, repeat=20):
+    """ Compares the query plans and times of the iexact lookups with the normalized search_* columns """
+    return rolled_back(_bench_normalized_lookups, courses, repeat)
+
+SEMESTERS = ("fa08", "sp09", "fa09", "sp10", "fa10", "sp11")
+NAME_SYLLABLES = ("har", "vey", "hil", "fin", "ger", "gar", "ci", "ka", "tz", "mo", "ran", "son", "lee", "wu", "chen",
+                  "ber", "stein", "ko", "lo", "ma", "ny", "ro", "se", "ta")
+
+def _name(rng, syllables):
+    return "".join([rng.choice(NAME_SYLLABLES) for i in range(syllables)]).capitalize()
+
+def make_schedule(departments=50, courses=5000, klasses=20000, instructors=3000, seed=0):
+    """
+    Creates a make_catalog catalog, then klasses spread over its courses and SEMESTERS, taught by one or two of
+    instructors synthetic instructors of the course's department, through the catalog importer.
+    Also creates a few subjects. Returns the departments.
+    """
+    from courses.models import Subject, Course
+    from courses.importer import CatalogImporter, bulk_create
+    rng = random.Random(seed)
+    depts = make_catalog(departments, courses)
+    bulk_create(Subject, [Subject(name="Subject %d" % i, major=i % 2 == 0) for i in range(departments)])
+
+    names = []
+    for i in range(instructors):
+        names.append((depts[i % departments].abbr, _name(rng, rng.randint(2, 3)), _name(rng, 2)))
+    by_department = {}
+    for name in names:
+        by_department.setdefault(name[0], []).append(name)
+
+    def records():
+        rows = list(Course.objects.values_list('department_abbr', 'coursenumber'))
+        for i in range(klasses):
+            abbr, coursenumber = rows[i % len(rows)]
+            teachers = by_department.get(abbr) or names
+            record = {"department": abbr, "coursenumber": coursenumber,
+                      "semester": SEMESTERS[(i // len(rows)) % len(SEMESTERS)], "section": str(i // (len(rows) * len(SEMESTERS)) + 1),
+                      "section_type": "LEC", "instructors": []}
+            for home, last, first in rng.sample(teachers, min(len(teachers), rng.randint(1, 2))):
+                record["instructors"].append({"last": last, "first": first, "department": home})
+            yield record
+    # in the caller's transaction, so rolled_back can discard it
+    CatalogImporter(batch_size=1000, commit=False).run(records())
+    return depts
+
+def _percentile(times, fraction):
+    return times[min(len(times) - 1, int(len(times) * fraction))]
+
+def measure(func, args, repeat=3, setup=None):
+    """
+    Calls func on every element of args, repeat times, calling setup (untimed) before each call.
+    Returns {calls, queries, mean_ms, min_ms, p50_ms, p90_ms, p99_ms, max_ms}, with queries per call.
+    """
+    times = []
+    queries = 0
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        for i in xrange(repeat):
+            for arg in args:
+                if setup:
+                    setup()
+                before = len(connection.queries)
+                start = default_timer()
+                func(arg)
+                times.append(default_timer() - start)
+                queries += len(connection.queries) - before
+                del connection.queries[:]
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+    times.sort()
+    ms = [t * 1e3 for t in times]
+    return {
+        "calls": len(ms),
+        "queries": float(queries) / len(ms),
+        "mean_ms": sum(ms) / len(ms),
+        "min_ms": ms[0],
+        "p50_ms": _percentile(ms, 0.5),
+        "p90_ms": _percentile(ms, 0.9),
+        "p99_ms": _percentile(ms, 0.99),
+        "max_ms": ms[-1],
+    }
+
+def _bump_versions():
+    from courses.cache import bump_version
+    for name in ('course', 'department', 'klass', 'instructor', 'subject'):
+        bump_version(name)
+
+def _bench_suite(departments, courses, klasses, instructors, repeat, seed):
+    from django.test.client import Client
+    from courses.models import Department, Course, Instructor
+    from courses.memoize import clear_memoized
+
+    make_schedule(departments, courses, klasses, instructors, seed)
+    rng = random.Random(seed)
+    depts = list(Department.objects.values_list('abbr', 'name'))
+    course_rows = list(Course.objects.values_list('department_abbr', 'coursenumber'))
+    instructor_rows = list(Instructor.objects.values_list('last', 'first', 'home_department_abbr'))
+    sample = lambda rows, n: rng.sample(rows, min(len(rows), n))
+
+    course_queries = ["%s %s" % row for row in sample(course_rows, 20)]
+    course_queries += ["%s %s" % (abbr, coursenumber[:1]) for abbr, coursenumber in sample(course_rows, 10)]
+    course_queries += [abbr for abbr, name in sample(depts, 10)]
+    instructor_queries = [last[:3] for last, first, abbr in sample(instructor_rows, 20)]
+    instructor_queries += ["%s, %s" % (last, first) for last, first, abbr in sample(instructor_rows, 10)]
+    instructor_queries += ["%s, %s [%s]" % row for row in sample(instructor_rows, 10)]
+    hints = [(last, first, (abbr,)) for last, first, abbr in sample(instructor_rows, 20)]
+    hints += [(last[:3], None, None) for last, first, abbr in sample(instructor_rows, 20)]
+    department_names = [name[:len(name) - 2] for abbr, name in sample(depts, 20)]
+
+    result = {
+        "catalog": {"departments": departments, "courses": courses, "klasses": klasses, "instructors": instructors,
+                    "seed": seed, "vendor": connection.vendor},
+        "timings": {},
+    }
+    timings = result["timings"]
+    timings["Course.ft_query"] = measure(lambda q: list(Course.objects.ft_query(q)[:15]), course_queries, repeat)
+    timings["Instructor.ft_query"] = measure(lambda q: list(Instructor.objects.ft_query(q)[:15]), instructor_queries, repeat)
+    timings["Instructor.hinted_query"] = measure(
+        lambda h: list(Instructor.objects.hinted_query(last_name=h[0], last_startswith=h[1] is None, first_name=h[1],
+                                                       department_abbrs=h[2])[:15]), hints, repeat)
+    timings["Course.parse_query"] = measure(Course.QuerySet.parse_query.uncached, course_queries, repeat)
+    timings["Instructor.parse_query"] = measure(Instructor.QuerySet.parse_query.uncached, instructor_queries, repeat)
+
+    views = (
+        ("course_autocomplete", [{"q": q} for q in course_queries]),
+        ("department_autocomplete", [{"q": q} for q in department_names]),
+        ("subject_autocomplete", [{"q": "Subject %d" % i} for i in range(10)]),
+        ("coursenumber_autocomplete", [{"q": coursenumber[:1], "department_query": abbr} for abbr, coursenumber in sample(course_rows, 20)]),
+        ("instructor_autocomplete", [{"q": q[:3], "course_query": c} for q, c in zip(instructor_queries, course_queries)]),
+        ("catalog_bundle", [{}]),
+    )
+    client = Client()
+    urlconf = settings.ROOT_URLCONF
+    settings.ROOT_URLCONF = 'courses.urls'
+    clear_url_caches()
+    try:
+        for name, params in views:
+            get = lambda p: client.get('/%s/' % name, p)
+            # cold: every catalog cache emptied before each request; warm: served from the caches
+            timings["view:%s:cold" % name] = measure(get, params, repeat, setup=lambda: (_bump_versions(), clear_memoized()))
+            timings["view:%s:warm" % name] = measure(get, params, repeat)
+    finally:
+        settings.ROOT_URLCONF = urlconf
+        clear_url_caches()
+    return result
+
+def bench_suite(departments=50, courses=5000, klasses=20000, instructors=3000, repeat=3, seed=0):
+    """
+    Times the search paths and the autocomplete views on a synthetic schedule, which is rolled back afterwards.
+    Returns {"catalog": parameters, "timings": {name: measure() result}}.
+    """
+    return rolled_back(_bench_suite, departments, courses, klasses, instructors, repeat, seed)
@@ -0,0 +1,43 @@
+"""
+Catalog bundle for autocompleting in the browser.
+
+The bundle is one compact JSON document with every visible department and
+its courses:
+
+    {"version": "...",
+     "departments": [[id, name, nice abbr, [all abbrs]], ...],
+     "courses": [[department id, id, coursenumber, name], ...]}
+
+It is built once per catalog version and cached.  Pages link to it with the
+version in the URL, so browsers and proxies can keep it until the catalog
+changes; see the catalog_bundle view and the local mode of the autocomplete
+widgets.
+"""
+import hashlib
+import json
+
+from courses.cache import cached, catalog_version
+from courses.constants import DEPT_ABBRS
+
+__all__ = ["BUNDLE_DEPENDS", "bundle_version", "bundle_etag", "build_catalog_bundle", "get_catalog_bundle"]
+
+BUNDLE_DEPENDS = ('course', 'department')
+
+def bundle_version():
+    return catalog_version(BUNDLE_DEPENDS)
+
+def bundle_etag(version):
+    return '"%s"' % hashlib.md5(version).hexdigest()
+
+def build_catalog_bundle(version):
+    """ Returns the bundle as a JSON string """
+    from courses.models import Department, Course
+    departments = [[id, name, Department.get_nice_abbr(abbr), list(DEPT_ABBRS.get(abbr, [abbr]))]
+                   for id, name, abbr in Department.objects.order_by('name').values_list('id', 'name', 'abbr')]
+    courses = Course.objects.filter(department__hidden=False).order_by('department', 'integer_number', 'coursenumber')
+    courses = [list(row) for row in courses.values_list('department', 'id', 'coursenumber', 'name').iterator()]
+    return json.dumps({"version": version, "departments": departments, "courses": courses}, separators=(',', ':'))
+
+def get_catalog_bundle(version):
+    """ Returns the JSON string of the bundle of version, the current bundle_version() """
+    return cached('catalog-bundle', BUNDLE_DEPENDS, (version,), lambda: build_catalog_bundle(version))
@@ -0,0 +1,109 @@
+"""
+Versioned caching of catalog lookups.
+
+Every model that lookups depend on has a version number stored in the cache.
+Cached results are keyed by the versions of the models they were computed
+from, so bumping a version (which the post_save/post_delete receivers in
+courses.models do) makes every dependent entry unreachable at once.
+VersionedValue keeps a process-local value, such as an in-memory index, in
+step with the same versions.
+"""
+import hashlib, threading, time
+
+from django.conf import settings
+from django.core.cache import cache
+
+__all__ = ["get_versions", "bump_version", "catalog_version", "make_key", "cached", "VersionedValue", "bump_model_version",
+           "bump_instructor_version"]
+
+CACHE_PREFIX = getattr(settings, 'COURSES_CACHE_PREFIX', 'courses')
+CACHE_TIMEOUT = getattr(settings, 'COURSES_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# memcached reads anything longer than 30 days as a timestamp
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+def _version_key(name):
+    return '%s:version:%s' % (CACHE_PREFIX, name)
+
+def _new_version():
+    # seeding from the clock means an evicted version never comes back with an old value
+    return int(time.time() * 1000)
+
+def get_versions(names):
+    """ Returns the current versions of the named models, initializing missing ones """
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    result = []
+    for key in keys:
+        version = versions.get(key)
+        if version is None:
+            version = _new_version()
+            if not cache.add(key, version, VERSION_TIMEOUT):
+                version = cache.get(key, version)
+        result.append(version)
+    return result
+
+def bump_version(name):
+    key = _version_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), VERSION_TIMEOUT)
+
+def catalog_version(depends):
+    """ A string that changes whenever one of the models named in depends changes """
+    return ".".join([str(version) for version in get_versions(depends)])
+
+def make_key(namespace, depends, parts):
+    versions = catalog_version(depends)
+    digest = hashlib.md5(u"|".join([unicode(part) for part in parts]).encode('utf-8')).hexdigest()
+    return '%s:%s:%s:%s' % (CACHE_PREFIX, namespace, versions, digest)
+
+def cached(namespace, depends, parts, func, timeout=None):
+    """
+    Returns func(), cached under a key built from parts and the versions of the models named in depends.
+    func must return a picklable value other than None.
+    """
+    key = make_key(namespace, depends, parts)
+    result = cache.get(key)
+    if result is None:
+        result = func()
+        cache.set(key, result, timeout or CACHE_TIMEOUT)
+    return result
+
+class VersionedValue(object):
+    """
+    A value built lazily by build(), and rebuilt once the versions of the models named in depends change in any
+    process, or when invalidate() is called.
+    """
+    def __init__(self, build, depends):
+        self.build = build
+        self.depends = depends
+        # (version, value), replaced as a whole so readers need no lock
+        self.current = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        version = catalog_version(self.depends)
+        current = self.current
+        if current is None or current[0] != version:
+            self.lock.acquire()
+            try:
+                current = self.current
+                if current is None or current[0] != version:
+                    # built after reading the version, so a change during the build only causes another rebuild
+                    current = self.current = (version, self.build())
+            finally:
+                self.lock.release()
+        return current[1]
+
+    def invalidate(self):
+        self.current = None
+
+def bump_model_version(sender, **kwargs):
+    """ post_save/post_delete receiver """
+    bump_version(sender._meta.object_name.lower())
+
+def bump_instructor_version(sender, **kwargs):
+    """ m2m_changed receiver for the Instructor relations """
+    bump_version('instructor')
@@ -0,0 +1,68 @@
+"""
+HTTP caching for the courses views.
+
+Views decorated with catalog_conditional send an ETag built from the catalog
+version (the cache versions of the models they read, bumped whenever one of
+them is saved or deleted) and the request's URL, answer a matching
+If-None-Match with 304 without running the view, and send a Cache-Control
+max-age so browsers and proxies can reuse the response without asking.
+
+max-age is COURSES_MAX_AGE seconds, or COURSES_MAX_AGES[url name] for the
+route of that name in courses.urls; the major and minor autocomplete routes
+go by the subject autocomplete's name.  The catalog bundle view sets its own.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from courses.cache import catalog_version
+
+__all__ = ["CATALOG_MODELS", "catalog_etag", "etag_matches", "catalog_conditional"]
+
+CATALOG_MODELS = ('course', 'department', 'klass', 'instructor', 'subject')
+DEFAULT_MAX_AGE = getattr(settings, 'COURSES_MAX_AGE', 60 * 5)
+MAX_AGES = getattr(settings, 'COURSES_MAX_AGES', {})
+
+def catalog_etag(request, depends=CATALOG_MODELS, vary=()):
+    """ An ETag for the response to request, which changes with the catalog version and the headers in vary """
+    parts = [catalog_version(depends), request.get_full_path()]
+    parts.extend([request.META.get('HTTP_' + header.upper().replace('-', '_'), '') for header in vary])
+    return '"%s"' % hashlib.md5("|".join(parts)).hexdigest()
+
+def etag_matches(request, etag):
+    """ whether the If-None-Match header of request names etag """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = [e.strip() for e in if_none_match.split(',')]
+    return etag in etags or '*' in etags
+
+def catalog_conditional(name, depends=CATALOG_MODELS, vary=()):
+    """
+    Decorator for the view of the route called name, whose response only changes with the catalog version of the
+    models named in depends, the URL and the request headers in vary. Responses that vary are not marked public.
+    """
+    max_age = MAX_AGES.get(name, DEFAULT_MAX_AGE)
+    def decorator(view):
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            etag = catalog_etag(request, depends, vary)
+            if etag_matches(request, etag):
+                response = HttpResponseNotModified()
+            else:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            if vary:
+                patch_cache_control(response, max_age=max_age)
+                patch_vary_headers(response, vary)
+            else:
+                patch_cache_control(response, public=True, max_age=max_age)
+            return response
+        return wraps(view)(wrapper)
+    return decorator
@@ -1,12 +1,26 @@
-#!/usr/bin/env python
-from django.core.management import setup_environ
-from django.core.exceptions import ObjectDoesNotExist
-import re, django, sys, pickle, glob, os, os.path
-from xml.dom import minidom
+"""
+Department abbreviation tables.
 
+DEPT_ABBRS maps each official abbreviation to all of its abbreviations (the
+common one first), DEPT_ABBRS_INV maps every abbreviation back to the official
+one, and DEPT_ABBRS_SET holds every known abbreviation.
+
+The tables are built on first access, from COMMON_ABBRS and the departments in
+data/departments-sanitized.xml.  The abbreviations read from the XML are kept
+in a small JSON cache next to it, which is regenerated whenever the XML is
+newer.
+"""
+import os, os.path, threading
+import json
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+__all__ = ["COMMON_ABBRS", "DEPT_ABBRS", "DEPT_ABBRS_INV", "DEPT_ABBRS_SET"]
 
 # "OFFICIAL ABBR" : ("UNOFFICIAL ABBR", others...)
-DEPT_ABBRS = {
+COMMON_ABBRS = {
     "ASTRON": ("ASTRO",),
     "BIOLOGY": ("BIO",),
     "BIO ENG": ("BIOE",),
@@ -17,10 +31,10 @@ DEPT_ABBRS = {
     "COMPSCI": ("CS",),
     "EL ENG": ("EE",),
     "ENGIN": ("E", "ENG", "ENGINEERING"),
-    "HISTORY": ("HIST",), 
+    "HISTORY": ("HIST",),
     "IND ENG": ("IEOR",),
     "INTEGBI": ("IB",),
-    "LINGUIS": ("LING",), 
+    "LINGUIS": ("LING",),
     "MAT SCI": ("MSE",),
     "MEC ENG": ("ME",),
     "MCELLBI": ("MCB",),
@@ -33,31 +47,103 @@ DEPT_ABBRS = {
     "ENV SCI" : ("ENV SCI", "ENVIR SCI"),
     "ENVECON" : ("ENVECON", "ENVIR ECON & POLICY"),
     }
-DEPT_ABBRS_INV = {}
-DEPT_ABBRS_SET = set()
 
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEPARTMENT_FILE = os.path.join(DATA_DIR, "departments-sanitized.xml")
+DEPARTMENT_CACHE_FILE = os.path.join(DATA_DIR, "departments-sanitized.json")
 
+def parse_department_abbrs(path=DEPARTMENT_FILE):
+    """ Returns the abbr attribute of every department element in the XML file, streaming it """
+    abbrs = []
+    for event, element in iterparse(path):
+        if element.tag == "department":
+            abbrs.append(element.get('abbr', '').strip().upper())
+            element.clear()
+    return abbrs
 
-def main():
-    for k, v in DEPT_ABBRS.items():
+def load_department_abbrs(path=DEPARTMENT_FILE, cache_path=DEPARTMENT_CACHE_FILE):
+    """ Returns the department abbreviations from the XML file, through the JSON cache when it is up to date """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return []
+    try:
+        if os.path.getmtime(cache_path) >= mtime:
+            return json.load(open(cache_path))
+    except (OSError, IOError, ValueError):
+        pass
+    abbrs = parse_department_abbrs(path)
+    try:
+        cache_file = open(cache_path, "w")
+        try:
+            json.dump(abbrs, cache_file)
+        finally:
+            cache_file.close()
+    except (OSError, IOError):
+        # a read-only install just parses the XML each time
+        pass
+    return abbrs
+
+def build_tables(department_abbrs):
+    abbrs, inv, known = {}, {}, set()
+    for k, v in COMMON_ABBRS.items():
         if k not in v:
             v = list(v) + [k]
-            DEPT_ABBRS[k] = v
+        abbrs[k] = v
         for e in v:
-            DEPT_ABBRS_INV[e] = k
-        DEPT_ABBRS_INV[k] = k
-        DEPT_ABBRS_SET.add(k)
-        DEPT_ABBRS_SET.update(v)
-
-    departmentFile = os.path.join(os.getcwd(), os.path.dirname(__file__), "data", "departments-sanitized.xml")
-    dom = minidom.parse(file(departmentFile, "r"))
-    for department in dom.getElementsByTagName("department"):   
-        abbr = department.getAttribute('abbr').strip().upper()
-        if abbr in DEPT_ABBRS_SET:
+            inv[e] = k
+        inv[k] = k
+        known.add(k)
+        known.update(v)
+
+    for abbr in department_abbrs:
+        if abbr in known:
             continue
-        DEPT_ABBRS[abbr] = (abbr,)
-        DEPT_ABBRS_INV[abbr] = abbr
-        DEPT_ABBRS_SET.add(abbr)
+        abbrs[abbr] = (abbr,)
+        inv[abbr] = abbr
+        known.add(abbr)
+    return {"DEPT_ABBRS": abbrs, "DEPT_ABBRS_INV": inv, "DEPT_ABBRS_SET": known}
+
+_tables = None
+_tables_lock = threading.Lock()
+
+def get_tables():
+    global _tables
+    if _tables is None:
+        _tables_lock.acquire()
+        try:
+            if _tables is None:
+                _tables = build_tables(load_department_abbrs())
+        finally:
+            _tables_lock.release()
+    return _tables
+
+class LazyTable(object):
+    """ Stands in for one of the tables, building them all on first use """
+    def __init__(self, name):
+        self._name = name
+
+    def _table(self):
+        return get_tables()[self._name]
+
+    def __getattr__(self, attr):
+        return getattr(self._table(), attr)
+
+    def __contains__(self, item):
+        return item in self._table()
+
+    def __getitem__(self, key):
+        return self._table()[key]
+
+    def __iter__(self):
+        return iter(self._table())
+
+    def __len__(self):
+        return len(self._table())
 
-main()
+    def __repr__(self):
+        return repr(self._table())
 
+DEPT_ABBRS = LazyTable("DEPT_ABBRS")
+DEPT_ABBRS_INV = LazyTable("DEPT_ABBRS_INV")
+DEPT_ABBRS_SET = LazyTable("DEPT_ABBRS_SET")
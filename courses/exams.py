@@ -0,0 +1,242 @@
+"""
+Published exam statistics of departments and courses.
+
+Exams live in another app.  The model is named by COURSES_EXAM_MODEL in
+settings ("exam.Exam" by default), and needs foreign keys to Department and
+Course and a publishable flag.  Its receivers are connected as soon as that
+model is loaded.
+
+The top departments and courses by published exams are kept in leaderboards:
+cache entries holding the LEADERBOARD_SIZE rows (count, name, id) with the
+most published exams, which the exam receivers adjust as exams are published,
+unpublished, moved or deleted, each under a lock kept in the cache.  Every department or course left out of a
+leaderboard has no more exams than its last row, so its first n rows are the
+top n whenever it has n rows or holds every department or course with a
+published exam.  Bulk updates send no signals; the rebuild_exam_leaderboards
+command recomputes the leaderboards from scratch.
+
+The receivers also keep the published_exams counters of Department and
+Course, which reconcile_exam_counts recomputes the same way.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, connection
+from django.db.models import F
+from django.db.models.signals import class_prepared, post_init, post_save, post_delete
+
+from courses.cache import CACHE_PREFIX, VERSION_TIMEOUT
+from courses.index import MAX_IN_IDS
+
+__all__ = ["LEADERBOARD_SIZE", "get_leaderboard", "rebuild_leaderboard", "update_leaderboard",
+           "annotate_exam_counters", "reconcile_exam_counts", "top_by_published_exams", "connect_exam_receivers"]
+
+EXAM_MODEL = getattr(settings, 'COURSES_EXAM_MODEL', 'exam.Exam')
+LEADERBOARD_SIZE = getattr(settings, 'COURSES_LEADERBOARD_SIZE', 50)
+
+# a leaderboard's lock expires after LOCK_TIMEOUT seconds, in case its holder died; others wait for it
+# LOCK_ATTEMPTS times LOCK_WAIT seconds
+LOCK_TIMEOUT = 10
+LOCK_ATTEMPTS = 20
+LOCK_WAIT = 0.01
+
+def _stats_models():
+    from courses.models import Department, Course
+    # Department.objects leaves out hidden departments, which are filtered when reading
+    return {Department: Department.all, Course: Course.objects}
+
+def _leaderboard_key(model):
+    return '%s:exam-leaderboard:%s' % (CACHE_PREFIX, model._meta.object_name.lower())
+
+def _rows(queryset):
+    return queryset.all().annotate_exam_count(True).order_by('-exam_count', 'name').values_list('exam_count', 'name', 'id')
+
+def _lock(model):
+    """
+    Takes the lock of the leaderboard of model, a cache entry made with add(), so receivers in several processes
+    don't overwrite each other's updates. Returns False if it stays taken.
+    """
+    key = _leaderboard_key(model) + ':lock'
+    for attempt in range(LOCK_ATTEMPTS):
+        if cache.add(key, 1, LOCK_TIMEOUT):
+            return True
+        time.sleep(LOCK_WAIT)
+    return False
+
+def _unlock(model):
+    cache.delete(_leaderboard_key(model) + ':lock')
+
+def rebuild_leaderboard(model):
+    """ Recomputes the leaderboard of model (Department or Course) with one aggregate query; returns it """
+    # without the lock, an update in progress could be lost, so the leaderboard is only returned
+    locked = _lock(model)
+    try:
+        rows = [tuple(row) for row in _rows(_stats_models()[model])[:LEADERBOARD_SIZE]]
+        leaderboard = (rows, len(rows) < LEADERBOARD_SIZE)
+        if locked:
+            cache.set(_leaderboard_key(model), leaderboard, VERSION_TIMEOUT)
+    finally:
+        if locked:
+            _unlock(model)
+    return leaderboard
+
+def get_leaderboard(model):
+    """ Returns (rows, complete), where complete tells whether rows has every object with a published exam """
+    leaderboard = cache.get(_leaderboard_key(model))
+    if leaderboard is None:
+        leaderboard = rebuild_leaderboard(model)
+    return leaderboard
+
+def update_leaderboard(leaderboard, id, delta, fetch, size=LEADERBOARD_SIZE):
+    """
+    Returns the leaderboard (rows, complete) after the count of id changed by delta, or None if it didn't change.
+    fetch(id) returns the (count, name, id) row of id, with its new count, or None if it has no published exams.
+    """
+    rows, complete = leaderboard
+    rows = list(rows)
+    for i, row in enumerate(rows):
+        if row[2] == id:
+            row = (row[0] + delta,) + row[1:]
+            del rows[i]
+            break
+    else:
+        if delta <= 0:
+            # it had no more exams than the last row, and now has fewer
+            return None
+        row = fetch(id)
+        if row is None:
+            return None
+
+    if row[0] <= 0:
+        return rows, complete
+    # unless the leaderboard is complete, whatever isn't in it may have up to as many exams as its last row
+    if not complete and (not rows or row[0] < rows[-1][0]):
+        return rows, complete
+    rows.append(row)
+    rows.sort(key=lambda r: (-r[0], r[1]))
+    if len(rows) > size:
+        del rows[size:]
+        complete = False
+    return rows, complete
+
+def _adjust(model, id, delta):
+    """ Applies delta to the cached leaderboard of model under its lock; drops the leaderboard if the lock stays taken """
+    key = _leaderboard_key(model)
+    if not _lock(model):
+        # rebuilt on the next read
+        cache.delete(key)
+        return
+    try:
+        leaderboard = cache.get(key)
+        if leaderboard is None:
+            # built on the next read
+            return
+        manager = _stats_models()[model]
+        def fetch(id):
+            rows = list(_rows(manager.filter(pk=id)))
+            return tuple(rows[0]) if rows else None
+        leaderboard = update_leaderboard(leaderboard, id, delta, fetch)
+        if leaderboard is not None:
+            cache.set(key, leaderboard, VERSION_TIMEOUT)
+    finally:
+        _unlock(model)
+
+def annotate_exam_counters(queryset):
+    """ Like annotate_exam_count(True), reading the published_exams counters instead of joining the exams """
+    column = '%s.%s' % (connection.ops.quote_name(queryset.model._meta.db_table), connection.ops.quote_name('published_exams'))
+    return queryset.filter(published_exams__gt=0).extra(select={'exam_count': column})
+
+def reconcile_exam_counts(model):
+    """ Recomputes the published_exams counters of model with one aggregate query; returns how many were wrong """
+    manager = _stats_models()[model]
+    counts = dict(manager.all().annotate_exam_count(True).values_list('id', 'exam_count'))
+    changed = {}
+    for id, count in manager.values_list('id', 'published_exams'):
+        if counts.get(id, 0) != count:
+            changed.setdefault(counts.get(id, 0), []).append(id)
+    for count, ids in changed.items():
+        for start in range(0, len(ids), MAX_IN_IDS):
+            manager.filter(pk__in=ids[start:start + MAX_IN_IDS]).update(published_exams=count)
+    return sum([len(ids) for ids in changed.values()])
+
+def top_by_published_exams(queryset, n):
+    """
+    Returns the n objects of queryset with the most published exams, with their count as exam_count, read from
+    the leaderboard; or None if the leaderboard can't tell, because of its size or the filters of queryset.
+    """
+    if n > LEADERBOARD_SIZE:
+        return None
+    rows, complete = get_leaderboard(queryset.model)
+    objects = queryset.in_bulk([row[2] for row in rows]) if rows else {}
+    result = []
+    for count, name, id in rows:
+        if len(result) == n:
+            break
+        if id in objects:
+            objects[id].exam_count = count
+            result.append(objects[id])
+    if len(result) < n and not complete:
+        if len(rows) < n:
+            # it shrank as exams were unpublished; refill it for the next read
+            rebuild_leaderboard(queryset.model)
+        return None
+    return result
+
+class ExamReceivers(object):
+    """ The receivers of the exam model, which keep the leaderboards and the published_exams counters current """
+    def __init__(self, exam_model):
+        self.exam_model = exam_model
+        # [(Department or Course, attname of the exam's foreign key to it)]
+        self.fields = []
+        for model in _stats_models():
+            for field in exam_model._meta.fields:
+                if getattr(field.rel, 'to', None) is model:
+                    self.fields.append((model, field.attname))
+
+    def state(self, instance):
+        return (instance.publishable,) + tuple([getattr(instance, attname) for model, attname in self.fields])
+
+    def post_init(self, sender, instance, **kwargs):
+        # deferred fields would be loaded with a query each
+        if 'publishable' in instance.__dict__:
+            instance._courses_exam_state = self.state(instance)
+
+    def post_save(self, sender, instance, created, **kwargs):
+        old = getattr(instance, '_courses_exam_state', None)
+        new = self.state(instance)
+        instance._courses_exam_state = new
+        if created:
+            self.apply(new, 1)
+        elif old is not None and old != new:
+            self.apply(old, -1)
+            self.apply(new, 1)
+
+    def post_delete(self, sender, instance, **kwargs):
+        self.apply(getattr(instance, '_courses_exam_state', None) or self.state(instance), -1)
+
+    def apply(self, state, delta):
+        if not state[0]:
+            return
+        for (model, attname), id in zip(self.fields, state[1:]):
+            if id is not None:
+                _stats_models()[model].filter(pk=id).update(published_exams=F('published_exams') + delta)
+                _adjust(model, id, delta)
+
+    def connect(self):
+        post_init.connect(self.post_init, sender=self.exam_model, weak=False, dispatch_uid='courses.exams')
+        post_save.connect(self.post_save, sender=self.exam_model, weak=False, dispatch_uid='courses.exams')
+        post_delete.connect(self.post_delete, sender=self.exam_model, weak=False, dispatch_uid='courses.exams')
+
+def _exam_model_prepared(sender, **kwargs):
+    if "%s.%s" % (sender._meta.app_label, sender._meta.object_name) == EXAM_MODEL:
+        ExamReceivers(sender).connect()
+
+def connect_exam_receivers():
+    """ Connects the receivers to the exam model, now if it's loaded or else when it is """
+    app_label, name = EXAM_MODEL.split('.')
+    exam_model = models.get_model(app_label, name, seed_cache=False, only_installed=False)
+    if exam_model is not None:
+        ExamReceivers(exam_model).connect()
+    else:
+        class_prepared.connect(_exam_model_prepared, weak=False)
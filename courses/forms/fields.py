@@ -109,13 +109,23 @@ def _make_many_field(clazz, name):
             if not isinstance(value, (tuple, list)):
                 raise forms.ValidationError("Please supply a list of values")
 
-            elements = []
+            ids, invalid = [], []
             for element_id, element_display in value:
                 try:
-                    elements.append(clazz._default_manager.get(pk=int(element_id)))
-                except (ValueError, clazz.DoesNotExist):
-                    raise forms.ValidationError("Invalid %s with id %s" % (name, element_id))
-            return elements
+                    ids.append(int(element_id))
+                except (ValueError, TypeError):
+                    invalid.append(element_id)
+
+            # one query for all of them, then back in the submitted order
+            found = clazz._default_manager.in_bulk(ids) if ids else {}
+            for id in ids:
+                if id not in found and id not in invalid:
+                    invalid.append(id)
+            if invalid:
+                if len(invalid) == 1:
+                    raise forms.ValidationError("Invalid %s with id %s" % (name, invalid[0]))
+                raise forms.ValidationError("Invalid %ss with ids %s" % (name, ", ".join([unicode(id) for id in invalid])))
+            return [found[id] for id in ids]
     return ManyField
 
 ManyCoursesField = _make_many_field(Course, 'course')
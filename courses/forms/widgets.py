@@ -6,6 +6,7 @@ from django.core.urlresolvers import reverse
 from django.utils.safestring import mark_safe
 from ajaxwidgets.widgets import ModelAutocomplete
 from courses.models import Course, Department
+from courses.bundle import bundle_version
 
 import re
 
@@ -14,17 +15,58 @@ AUTOCOMPLETE_URLS = {
 'coursenumber' : '/courses/coursenumber_autocomplete/',
 'instructor' : '/courses/instructor_autocomplete/',
 'subject' : '/courses/subject_autocomplete/',
+'catalog' : '/courses/catalog_bundle/',
 }
 
-class DepartmentAutocomplete(ModelAutocomplete):
-    def __init__(self, list_series=1, abbreviations=False, *args, **kwargs):
+def catalog_bundle_url():
+    """ the URL of the current catalog bundle, which browsers can cache until the catalog changes """
+    return "%s?v=%s" % (AUTOCOMPLETE_URLS['catalog'], bundle_version())
+
+class LocalAutocompleteMixin(object):
+    """
+    With local=True, renders a plain input completed in the browser against the catalog bundle instead of the
+    autocomplete view, with the chosen id in a hidden input; the value is "text|id" like the remote widgets'.
+    """
+    def value_from_datadict(self, data, files, name):
+        if not self.local:
+            return super(LocalAutocompleteMixin, self).value_from_datadict(data, files, name)
+        return u"%s|%s" % (data.get(name, u''), data.get(name + '_id', u''))
+
+    def render_local(self, name, value, attrs, script):
+        text, id = u'', u''
+        if value:
+            text, bar, id = unicode(value).partition(u'|')
+        input_id = (attrs or {}).get('id') or 'id_%s' % name
+        html = forms.TextInput(self.attrs).render(name, text, attrs)
+        html += forms.HiddenInput().render(name + '_id', id, {'id': input_id + '_id'})
+        return mark_safe(html + u"""
+<script language="javascript">
+    $(document).ready( function() {
+        %s
+        catalog.keep_id($('#%s'), $('#%s_id'));
+    });
+</script>
+""" % (script, input_id, input_id))
+
+    class Media:
+        js = ( settings.STATIC_URL + "courses/course.js", )
+
+class DepartmentAutocomplete(LocalAutocompleteMixin, ModelAutocomplete):
+    def __init__(self, list_series=1, abbreviations=False, local=False, *args, **kwargs):
         kwargs['attrs'] = kwargs.get('attrs', {})
         kwargs['attrs'].update({'department_autocomplete' : list_series})
         self.list_series = list_series
+        self.local = local
         super(DepartmentAutocomplete, self).__init__(
             AUTOCOMPLETE_URLS['department'],
             *args, **kwargs)
 
+    def render(self, name, value=None, attrs={}):
+        if not self.local:
+            return super(DepartmentAutocomplete, self).render(name, value, attrs)
+        return self.render_local(name, value, attrs, u"""catalog.department_autocomplete($('[department_autocomplete=%s]'), '%s');"""
+                                 % (self.list_series, catalog_bundle_url()))
+
 class SubjectAutocomplete(ModelAutocomplete):
     def __init__(self, list_series=1, abbreviations=False, *args, **kwargs):
         kwargs['attrs'] = kwargs.get('attrs', {})
@@ -41,10 +83,12 @@ class SubjectAutocomplete(ModelAutocomplete):
 ''' % (self.__dict__)
 
 
-class CourseNumberAutocomplete(ModelAutocomplete):
-    def __init__(self, list_series=1, abbreviations=False, *args, **kwargs):
+class CourseNumberAutocomplete(LocalAutocompleteMixin, ModelAutocomplete):
+    def __init__(self, list_series=1, abbreviations=False, local=False, *args, **kwargs):
         kwargs['attrs'] = kwargs.get('attrs', {})
         kwargs['attrs'].update({'coursenumber_autocomplete' : list_series})
+        self.local = local
+        self.local_abbrs = 'true' if abbreviations else 'false'
         if abbreviations:
             abbreviations = ', abbrs : true'
         else:
@@ -59,16 +103,23 @@ class CourseNumberAutocomplete(ModelAutocomplete):
             *args, **kwargs)
 
     def render(self, name, value=None, attrs={}):
-        html = super(CourseNumberAutocomplete, self).render(name, value, attrs)
-        return mark_safe(html + u"""
-<p>&nbsp;</p>
+        if self.local:
+            # the department input narrows the courses offered, instead of being sent with every request
+            html = self.render_local(name, value, attrs, u"""catalog.coursenumber_autocomplete($('[coursenumber_autocomplete=%s]'), $('[department_autocomplete=%s]'), '%s', %s);"""
+                                     % (self.list_series, self.list_series, catalog_bundle_url(), self.local_abbrs))
+        else:
+            html = super(CourseNumberAutocomplete, self).render(name, value, attrs) + u"""
 <script language="javascript">
     $('[department_autocomplete=%(list_series)s]').focus( function() {
         $('[coursenumber_autocomplete=%(list_series)s]').flushCache();
     }).blur( function () {
         $('[coursenumber_autocomplete=%(list_series)s]').flushCache();
     });
-    
+</script>
+""" % (self.__dict__)
+        return mark_safe(html + u"""
+<p>&nbsp;</p>
+<script language="javascript">
     $('[coursenumber_autocomplete=%(list_series)s]').result( function(event, data, formatted) {
         courselist_result(data, %(list_series)s);
         $(this).attr('value', '');
@@ -126,10 +177,10 @@ class ElementList(forms.Widget):
         js = ( settings.STATIC_URL + "courses/course.js", settings.STATIC_URL + "courses/jquery.color.js", )
 
 class CourseAutocomplete(forms.MultiWidget):
-    def __init__(self, attrs=None, list_series=1):
+    def __init__(self, attrs=None, list_series=1, local=False):
         widgets = (
-            DepartmentAutocomplete(list_series=list_series, attrs={"style" : "width: 10em"}),
-            CourseNumberAutocomplete(list_series=list_series, attrs={"style" : "width: 4em"}),
+            DepartmentAutocomplete(list_series=list_series, local=local, attrs={"style" : "width: 10em"}),
+            CourseNumberAutocomplete(list_series=list_series, local=local, attrs={"style" : "width: 4em"}),
         )
         super(CourseAutocomplete, self).__init__(widgets, attrs)
 
@@ -0,0 +1,308 @@
+"""
+Bulk import of semester schedules.
+
+Each record describes one klass, with these keys:
+
+    department          any known abbreviation of the course's department
+    department_name     optional; used to create the department if it doesn't exist yet
+    coursenumber, name, description
+    semester, section, section_type, section_note, website, newsgroup
+    instructors         a list of {"last", "first", "middle", "email", "department"} dicts, where department
+                        defaults to the course's department. In CSV, a ";"-separated list of "Last, First".
+
+Records are read as a stream and written in batches, with bulk_create and bulk
+inserts into the m2m through tables.  Courses are matched on (department,
+coursenumber), klasses on (course, semester, section) and instructors on
+(home department, last, first), so existing rows are updated rather than
+duplicated and an import can be rerun.
+"""
+import csv, json
+from timeit import default_timer
+
+from django.db import transaction
+
+from courses.models import Department, Course, Klass, Instructor
+from courses.cache import bump_version
+from courses.index import MAX_IN_IDS, invalidate_course_index
+from courses.instructor_index import invalidate_instructor_index
+from courses.search import get_search_backend
+
+__all__ = ["read_csv", "read_json", "bulk_create", "CatalogImporter", "import_catalog"]
+
+KLASS_FIELDS = ('section_type', 'section_note', 'website', 'newsgroup')
+
+def read_csv(f):
+    """ Yields the records of a CSV file with a header row """
+    for row in csv.DictReader(f):
+        record = dict((key, (value or '').decode('utf-8')) for key, value in row.items() if key)
+        instructors = []
+        for name in record.get('instructors', '').split(';'):
+            if name.strip():
+                last, comma, first = name.partition(',')
+                instructors.append({'last': last.strip(), 'first': first.strip()})
+        record['instructors'] = instructors
+        yield record
+
+def read_json(f):
+    """ Yields the records of a JSON array, or of a file with one JSON object per line """
+    line = f.readline()
+    if line.lstrip().startswith('['):
+        for record in json.loads(line + f.read()):
+            yield record
+        return
+    while line:
+        if line.strip():
+            yield json.loads(line)
+        line = f.readline()
+
+def bulk_create(model, objects):
+    """ bulk_create in batches that stay under SQLite's limit of 999 parameters per statement """
+    batch = max(1, 900 // len(model._meta.fields))
+    for start in range(0, len(objects), batch):
+        model.objects.bulk_create(objects[start:start + batch])
+
+def _chunks(ids):
+    """ ids in lists of at most MAX_IN_IDS, which keeps __in lookups under SQLite's parameter limit """
+    ids = list(ids)
+    for start in range(0, len(ids), MAX_IN_IDS):
+        yield ids[start:start + MAX_IN_IDS]
+
+def _value(record, key):
+    return (record.get(key) or u'').strip()
+
+class CatalogImporter(object):
+    def __init__(self, batch_size=500, progress=None, commit=True):
+        """
+        progress, if given, is called with the stats dict after every batch. With commit, every batch is committed
+        in a transaction of its own; without, the batches are written in the caller's transaction.
+        """
+        self.batch_size = batch_size
+        self.progress = progress
+        self.commit = commit
+        self.semester_field = Klass._meta.get_field('semester')
+        self.departments = {}
+        self.stats = {
+            'records': 0, 'skipped': 0,
+            'courses_created': 0, 'courses_updated': 0,
+            'klasses_created': 0, 'klasses_updated': 0,
+            'instructors_created': 0, 'instructor_links_created': 0,
+            'elapsed': 0.0, 'rate': 0.0,
+        }
+
+    def run(self, records):
+        """ Imports records and returns the stats """
+        self.departments = dict((dept.abbr, dept) for dept in Department.all.all())
+        write = self.import_batch if self.commit else self.write_batch
+        start = default_timer()
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                write(batch)
+                self.report(start)
+                batch = []
+        if batch:
+            write(batch)
+            self.report(start)
+        self.invalidate()
+        return self.stats
+
+    def report(self, start):
+        self.stats['elapsed'] = default_timer() - start
+        self.stats['rate'] = self.stats['records'] / (self.stats['elapsed'] or 1)
+        if self.progress:
+            self.progress(self.stats)
+
+    def invalidate(self):
+        """ bulk writes send no signals, so drop the caches the signal receivers would have """
+        for name in ('course', 'department', 'klass', 'instructor'):
+            bump_version(name)
+        invalidate_course_index()
+        invalidate_instructor_index()
+        backend = get_search_backend()
+        backend.invalidate(Department)
+        backend.invalidate(Course)
+
+    def semester_key(self, value):
+        return self.semester_field.get_prep_value(self.semester_field.to_python(value))
+
+    def department(self, abbr, name=None):
+        abbr = Department.get_proper_abbr(abbr)
+        if not abbr:
+            return None
+        dept = self.departments.get(abbr)
+        if dept is None and name:
+            dept = Department.all.create(name=name, abbr=abbr)
+            self.departments[abbr] = dept
+        return dept
+
+    @transaction.commit_on_success
+    def import_batch(self, records):
+        """ write_batch, committed on its own """
+        self.write_batch(records)
+
+    def write_batch(self, records):
+        rows = []
+        for record in records:
+            self.stats['records'] += 1
+            dept = self.department(_value(record, 'department'), _value(record, 'department_name'))
+            coursenumber = _value(record, 'coursenumber').upper()
+            if dept is None or not coursenumber or not _value(record, 'semester'):
+                self.stats['skipped'] += 1
+                continue
+            rows.append((dept, coursenumber, record))
+        course_ids = self.upsert_courses(rows)
+        klass_ids = self.upsert_klasses(rows, course_ids)
+        self.link_instructors(rows, klass_ids)
+
+    def course_ids(self, keys):
+        """ {(department id, coursenumber): (id, name, description)} of the existing courses among keys """
+        keys = set(keys)
+        if not keys:
+            return {}
+        courses = Course.objects.filter(department__in=set([k[0] for k in keys]), coursenumber__in=set([k[1] for k in keys]))
+        result = {}
+        for id, department_id, coursenumber, name, description in courses.values_list('id', 'department', 'coursenumber', 'name', 'description'):
+            if (department_id, coursenumber) in keys:
+                result[(department_id, coursenumber)] = (id, name, description)
+        return result
+
+    def upsert_courses(self, rows):
+        wanted = {}
+        for dept, coursenumber, record in rows:
+            wanted[(dept.id, coursenumber)] = (dept, record)
+        existing = self.course_ids(wanted.keys())
+        new = []
+        for key, (dept, record) in wanted.items():
+            name, description = _value(record, 'name'), _value(record, 'description')
+            if key in existing:
+                id, old_name, old_description = existing[key]
+                if (name and name != old_name) or (description and description != old_description):
+                    Course.objects.filter(pk=id).update(name=name or old_name, description=description or old_description)
+                    self.stats['courses_updated'] += 1
+            else:
+                course = Course(department=dept, department_abbr=dept.abbr, coursenumber=key[1], name=name, description=description)
+                course.fill_derived_fields()
+                new.append(course)
+        bulk_create(Course, new)
+        self.stats['courses_created'] += len(new)
+        if new:
+            existing.update(self.course_ids([key for key in wanted if key not in existing]))
+        return dict((key, value[0]) for key, value in existing.items())
+
+    def klass_ids(self, keys, semesters):
+        """
+        {(course id, semester, section): (id, values of KLASS_FIELDS)} of the existing klasses among keys;
+        semesters are the semesters of the keys, as Semester values
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        klasses = Klass.objects.filter(course__in=set([k[0] for k in keys]), semester__in=semesters,
+                                       section__in=set([k[2] for k in keys]))
+        result = {}
+        for row in klasses.values_list('id', 'course', 'semester', 'section', *KLASS_FIELDS):
+            key = (row[1], self.semester_key(row[2]), row[3])
+            if key in keys:
+                result[key] = (row[0], row[4:])
+        return result
+
+    def upsert_klasses(self, rows, course_ids):
+        """ Returns the klass id of each row """
+        row_keys = []
+        wanted = {}
+        semesters = {}
+        for dept, coursenumber, record in rows:
+            semester = self.semester_field.to_python(_value(record, 'semester'))
+            key = (course_ids[(dept.id, coursenumber)], self.semester_field.get_prep_value(semester), _value(record, 'section'))
+            semesters[key[1]] = semester
+            row_keys.append(key)
+            wanted[key] = record
+        semesters = semesters.values()
+        existing = self.klass_ids(wanted.keys(), semesters)
+        new = []
+        for key, record in wanted.items():
+            values = tuple([_value(record, field) for field in KLASS_FIELDS])
+            if key in existing:
+                id, old_values = existing[key]
+                merged = tuple([value or old for value, old in zip(values, old_values)])
+                if merged != tuple(old_values):
+                    Klass.objects.filter(pk=id).update(**dict(zip(KLASS_FIELDS, merged)))
+                    self.stats['klasses_updated'] += 1
+            else:
+                new.append(Klass(course_id=key[0], semester=self.semester_field.to_python(_value(record, 'semester')),
+                                 section=key[2], **dict(zip(KLASS_FIELDS, values))))
+        bulk_create(Klass, new)
+        self.stats['klasses_created'] += len(new)
+        if new:
+            existing.update(self.klass_ids([key for key in wanted if key not in existing], semesters))
+        return [existing[key][0] for key in row_keys]
+
+    def instructor_ids(self, keys):
+        """ {(home department id, last, first): id} of the existing instructors among keys """
+        keys = set(keys)
+        if not keys:
+            return {}
+        instructors = Instructor.objects.filter(home_department__in=set([k[0] for k in keys]), last__in=set([k[1] for k in keys]))
+        result = {}
+        for id, home_department_id, last, first in instructors.values_list('id', 'home_department', 'last', 'first'):
+            if (home_department_id, last, first) in keys:
+                result[(home_department_id, last, first)] = id
+        return result
+
+    def link_instructors(self, rows, klass_ids):
+        wanted = {}
+        # in record order, so cached instructor names list instructors as the dump does
+        pairs = []
+        seen = set()
+        for (dept, coursenumber, record), klass_id in zip(rows, klass_ids):
+            for info in record.get('instructors') or ():
+                home = dept
+                if _value(info, 'department'):
+                    home = self.department(_value(info, 'department')) or dept
+                last, first = _value(info, 'last'), _value(info, 'first')
+                if not last:
+                    continue
+                key = (home.id, last, first)
+                wanted.setdefault(key, (home, info))
+                if (key, klass_id) not in seen:
+                    seen.add((key, klass_id))
+                    pairs.append((key, klass_id))
+        if not wanted:
+            return
+
+        existing = self.instructor_ids(wanted.keys())
+        new = []
+        for key, (home, info) in wanted.items():
+            if key not in existing:
+                # as Instructor.save does
+                new.append(Instructor(home_department=home, home_department_abbr=home.nice_abbr, last=key[1], first=key[2],
+                                      middle=_value(info, 'middle'), email=_value(info, 'email')))
+        bulk_create(Instructor, new)
+        self.stats['instructors_created'] += len(new)
+        if new:
+            existing.update(self.instructor_ids([key for key in wanted if key not in existing]))
+
+        # every instructor belongs to their home department, which Instructor.save also ensures
+        departments = Instructor.departments.through
+        memberships = set()
+        for chunk in _chunks(set(existing.values())):
+            memberships.update(departments.objects.filter(instructor__in=chunk).values_list('instructor', 'department'))
+        bulk_create(departments, [departments(instructor_id=existing[key], department_id=key[0])
+                                  for key in wanted if (existing[key], key[0]) not in memberships])
+
+        klasses = Instructor.klasses.through
+        links = set()
+        for chunk in _chunks(set(klass_ids)):
+            links.update(klasses.objects.filter(klass__in=chunk).values_list('instructor', 'klass'))
+        new_links = [klasses(instructor_id=existing[key], klass_id=klass_id)
+                     for key, klass_id in pairs if (existing[key], klass_id) not in links]
+        bulk_create(klasses, new_links)
+        self.stats['instructor_links_created'] += len(new_links)
+        for chunk in _chunks(set([klass_id for key, klass_id in pairs])):
+            Klass.objects.refresh_instructor_names(Klass.objects.filter(pk__in=chunk))
+
+def import_catalog(f, format='csv', batch_size=500, progress=None):
+    """ Imports the records of the open file f, in 'csv' or 'json' format; returns the stats """
+    reader = {'csv': read_csv, 'json': read_json}[format]
+    return CatalogImporter(batch_size=batch_size, progress=progress).run(reader(f))
@@ -0,0 +1,95 @@
+"""
+Process-local search index for Course.objects.ft_query.
+
+The index keeps one sorted array of (department abbr, number) keys, with a
+parallel array of (prefix, suffix, sort key, id) rows, so a department or
+department + course number prefix query is answered with two bisects instead
+of a table scan.  Only the final page of courses is fetched from the database,
+by primary key.
+
+The index is optional; enable it with COURSES_SEARCH_INDEX = True in settings.
+It is built lazily on first use and kept in a courses.cache.VersionedValue,
+so it is rebuilt once a course is saved or deleted in any process, not only
+in the one that saved it.
+"""
+from bisect import bisect_left
+
+from django.conf import settings
+
+from courses.cache import VersionedValue
+
+__all__ = ["CourseIndex", "get_course_index", "invalidate_course_index"]
+
+# past this many matches, a pk__in filter is worse than the plain query
+MAX_IN_IDS = 500
+
+class CourseIndex(object):
+    def __init__(self, rows):
+        """ rows is an iterable of (id, department_abbr, prefix, number, suffix, integer_number, coursenumber) """
+        entries = []
+        for id, department_abbr, prefix, number, suffix, integer_number, coursenumber in rows:
+            key = (department_abbr.upper(), number.upper())
+            sort_key = (department_abbr, integer_number, coursenumber)
+            entries.append((key, prefix, suffix, sort_key, id))
+        entries.sort()
+        self.keys = [e[0] for e in entries]
+        self.rows = [e[1:] for e in entries]
+
+    @classmethod
+    def build(cls):
+        from courses.models import Course
+        return cls(Course.objects.values_list('id', 'department_abbr', 'prefix', 'number', 'suffix', 'integer_number', 'coursenumber').order_by())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def search(self, dept_abbr, coursenumber=None):
+        """ Returns the ids of the courses matching a parsed query, in Course.Meta.ordering order """
+        return [id for sort_key, id in self.search_keys(dept_abbr, coursenumber)]
+
+    def search_keys(self, dept_abbr, coursenumber=None):
+        """ search, as sorted ((department_abbr, integer_number, coursenumber), id) keys """
+        if not dept_abbr:
+            return []
+        from courses.models import Course
+        dept_abbr = dept_abbr.upper()
+        prefix = suffix = ""
+        number = u""
+        if coursenumber:
+            prefix, number, suffix = Course.split_coursenumber(coursenumber)
+        lo = bisect_left(self.keys, (dept_abbr, number))
+        hi = bisect_left(self.keys, (dept_abbr, number + u"\uffff"))
+        matches = []
+        for row_prefix, row_suffix, sort_key, id in self.rows[lo:hi]:
+            if prefix and row_prefix != prefix:
+                continue
+            if suffix and row_suffix != suffix:
+                continue
+            matches.append((sort_key, id))
+        matches.sort()
+        return matches
+
+    def fetch(self, ids, fields=None):
+        """ Fetches the courses with the given ids, keeping their order; with fields, as tuples of those fields """
+        from courses.models import Course
+        if fields:
+            rows = Course.objects.filter(pk__in=ids).values_list('id', *fields)
+            courses = dict((row[0], row[1:]) for row in rows)
+        else:
+            courses = Course.objects.in_bulk(ids)
+        return [courses[id] for id in ids if id in courses]
+
+# the cache versions the index is built from
+INDEX_DEPENDS = ('course',)
+
+_index = VersionedValue(CourseIndex.build, INDEX_DEPENDS)
+
+def get_course_index():
+    """ Returns the course index, building it if needed, or None if the index is disabled """
+    if not getattr(settings, 'COURSES_SEARCH_INDEX', False):
+        return None
+    return _index.get()
+
+def invalidate_course_index(*args, **kwargs):
+    """ Drops the course index; usable directly as a signal receiver """
+    _index.invalidate()
@@ -1,17 +1,18 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
 
 from courses.models import *
+from courses.conditional import catalog_conditional
 
 from string import atoi
 
     
+@catalog_conditional('course-instructor-autocomplete')
 def instructor_autocomplete(request):
     def iter_results(instructors):
-        if instructors:
-            for instructor in instructors:
-                yield '%s|%s\n' % (instructor.short_name(first = True, dept = True), instructor.id)
+        for last, first, home_department_abbr, id in instructors:
+            yield '%s|%s\n' % (Instructor.format_short_name(last, first, home_department_abbr, first = True, dept = True), id)
     
     if not request.GET.get('q'):
         return HttpResponse(mimetype='text/plain')
@@ -25,10 +26,7 @@ def instructor_autocomplete(request):
     
     course_query = request.GET.get("course_query")
 
-    instructors = Instructor.objects.ft_query_inexact(q, course_query=course_query)
-    if len(instructors) == 0:
-        instructors = Instructor.objects.ft_query_inexact(q)
-    instructors = instructors[:limit]    
+    instructors = Instructor.objects.cached_autocomplete(q, course_query, limit)
     
     
     return HttpResponse(iter_results(instructors), mimetype='text/plain')
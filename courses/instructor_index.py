@@ -0,0 +1,171 @@
+"""
+Process-local search index for Instructor.objects.ft_query.
+
+The index keeps the instructors sorted by lowercased last name, so a last
+name or last name prefix is found with two bisects, along with each
+instructor's first name, department ids and taught course ids, and the
+department and number of every taught course.  Instructor.objects.ft_query
+and cached_autocomplete then decide the hints of hinted_query in memory, and
+only fetch the final rows from the database, by primary key.
+
+The index is optional; enable it with COURSES_INSTRUCTOR_INDEX = True in
+settings.  Like the course index, it is a courses.cache.VersionedValue: an
+instructor, department, course or klass change anywhere has it rebuilt.
+"""
+from bisect import bisect_left
+
+from django.conf import settings
+
+from courses.cache import VersionedValue
+
+__all__ = ["InstructorIndex", "get_instructor_index", "invalidate_instructor_index"]
+
+def _distinct(ids):
+    seen = set()
+    result = []
+    for id in ids:
+        if id not in seen:
+            seen.add(id)
+            result.append(id)
+    return result
+
+class InstructorIndex(object):
+    def __init__(self, instructors, departments, taught, courses, department_abbrs):
+        """
+        instructors is an iterable of (id, last, first), departments of (instructor id, department id), taught of
+        (instructor id, course id), courses of (id, search_department_abbr, number) and department_abbrs of
+        (id, abbr).
+        """
+        entries = sorted([(last.lower(), first.lower(), id) for id, last, first in instructors])
+        self.keys = [e[0] for e in entries]
+        self.ids = [e[2] for e in entries]
+        self.firsts = dict((e[2], e[1]) for e in entries)
+        self.departments = {}
+        for instructor_id, department_id in departments:
+            self.departments.setdefault(instructor_id, []).append(department_id)
+        self.courses = {}
+        for instructor_id, course_id in taught:
+            self.courses.setdefault(instructor_id, set()).add(course_id)
+        self.course_keys = dict((id, (department_abbr, number.upper())) for id, department_abbr, number in courses)
+        self.department_ids = dict((abbr, id) for id, abbr in department_abbrs)
+
+    @classmethod
+    def build(cls):
+        from courses.models import Department, Course, Instructor
+        taught = Instructor.klasses.through.objects.values_list('instructor', 'klass__course').distinct()
+        return cls(Instructor.objects.values_list('id', 'last', 'first').order_by(),
+                   Instructor.departments.through.objects.values_list('instructor', 'department'),
+                   taught,
+                   Course.objects.filter(klass__instructors__isnull=False).values_list('id', 'search_department_abbr', 'number').distinct(),
+                   Department.all.values_list('id', 'abbr'))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def candidates(self, last_name, last_startswith=False):
+        """ ids of the instructors with last name last_name (or starting with it), in (last, first) order """
+        key = last_name.lower()
+        lo = bisect_left(self.keys, key)
+        if last_startswith:
+            hi = bisect_left(self.keys, key + u"\uffff")
+        else:
+            hi = bisect_left(self.keys, key + u"\x00")
+        return self.ids[lo:hi]
+
+    def hinted(self, last_name, last_startswith=False, first_name=None, force_first=False, department_abbrs=None,
+               course_filter=None, exact=False):
+        """
+        The ids of the instructors hinted_query would return, in (last, first) order. course_filter, standing in
+        for the courses hint, tells whether a course id is one of the hinted courses.
+        Decides every step as Instructor.QuerySet.hinted_query_prefetched does.
+        """
+        rows = self.candidates(last_name, last_startswith)
+        if not force_first and not exact and len(rows) <= 1:
+            return rows
+
+        if first_name:
+            old_rows = rows
+            first = first_name.lower()
+            rows = [id for id in old_rows if self.firsts[id] == first]
+            if len(rows) == 0:
+                rows = [id for id in old_rows if self.firsts[id].startswith(first[0])]
+            if not exact:
+                if not force_first and len(rows) == 0:
+                    return old_rows
+                elif len(rows) == 1:
+                    return rows
+
+        if department_abbrs and len(department_abbrs) > 0:
+            old_rows = rows
+            wanted = set([self.department_ids[abbr] for abbr in department_abbrs if abbr in self.department_ids])
+            # like the join on departments, an instructor appears once per matching department
+            rows = [id for id in rows for department_id in self.departments.get(id, ()) if department_id in wanted]
+            if not exact:
+                if len(rows) == 0:
+                    return _distinct(old_rows)
+                elif len(rows) == 1:
+                    return rows
+
+        if course_filter:
+            old_rows = rows
+            rows = [id for id in _distinct(rows) if [c for c in self.courses.get(id, ()) if course_filter(c)]]
+            if not exact and len(rows) == 0:
+                return _distinct(old_rows)
+
+        return _distinct(rows)
+
+    def ft_query(self, query, course_query=None, dept_abbr=None, course_number=None, departments=None, exact=False,
+                 last_startswith=False, **kwargs):
+        """
+        The ids of the instructors Instructor.QuerySet.ft_query would return, in (last, first) order, or None if the
+        arguments need the database: a courses queryset or a query without a last name.
+        """
+        from courses.models import Department, Course, Instructor, normalize_search
+        if kwargs.get('courses') is not None:
+            return None
+        department_abbrs = None
+        if departments and len(departments) > 0:
+            department_abbrs = [Department.get_proper_abbr(dept) for dept in departments]
+
+        (last, first, dept_abbr) = Instructor.QuerySet.parse_query(query)
+        if not last:
+            return None
+        if department_abbrs is None and dept_abbr is not None:
+            department_abbrs = (dept_abbr,)
+
+        if course_query:
+            (dept_abbr, course_number) = Course.objects.parse_query(course_query)
+            department_abbrs = None
+
+        course_filter = None
+        if dept_abbr:
+            search_department_abbr = normalize_search(dept_abbr)
+            number = course_number and course_number.upper()
+            def course_filter(course_id):
+                key = self.course_keys.get(course_id)
+                return key is not None and key[0] == search_department_abbr and (not number or number in key[1])
+
+        return self.hinted(last, last_startswith=last_startswith, first_name=first, department_abbrs=department_abbrs,
+                           course_filter=course_filter, exact=exact)
+
+    def fetch(self, ids, fields):
+        """ Fetches the given fields of the instructors with the given ids as tuples, keeping their order """
+        from courses.models import Instructor
+        rows = Instructor.objects.filter(pk__in=ids).values_list('id', *fields)
+        instructors = dict((row[0], row[1:]) for row in rows)
+        return [instructors[id] for id in ids if id in instructors]
+
+# the cache versions the index is built from
+INDEX_DEPENDS = ('instructor', 'department', 'course', 'klass')
+
+_index = VersionedValue(InstructorIndex.build, INDEX_DEPENDS)
+
+def get_instructor_index():
+    """ Returns the instructor index, building it if needed, or None if the index is disabled """
+    if not getattr(settings, 'COURSES_INSTRUCTOR_INDEX', False):
+        return None
+    return _index.get()
+
+def invalidate_instructor_index(*args, **kwargs):
+    """ Drops the instructor index; usable directly as a signal receiver """
+    _index.invalidate()
@@ -0,0 +1,152 @@
+"""
+Per-URL instrumentation of the courses views.
+
+With COURSES_INSTRUMENT = True in settings and
+courses.instrument.InstrumentMiddleware in MIDDLEWARE_CLASSES, every request
+to a courses view is measured: its latency, the number and total time of its
+SQL queries, and the time spent in the parse_query functions.  The
+measurements are aggregated per URL name into in-process histograms, served
+as JSON by the instrument_stats view along with memoize_stats().
+
+Streamed responses, such as coursenumber_autocomplete's, are read into
+memory while they are measured, so the queries of their iterators count.
+
+Without the setting the middleware removes itself and the parse_query
+functions are left undecorated, so there is no overhead.
+"""
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.urlresolvers import resolve, Resolver404
+from django.db import connection
+
+__all__ = ["ENABLED", "BUCKETS_MS", "Histogram", "timed", "get_stats", "reset_stats", "InstrumentMiddleware"]
+
+ENABLED = getattr(settings, 'COURSES_INSTRUMENT', False)
+
+# upper bounds of the histogram buckets, in milliseconds or queries; the last bucket is unbounded
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+BUCKETS_COUNT = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram(object):
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def as_dict(self):
+        labels = ["<=%s" % bound for bound in self.bounds] + [">%s" % self.bounds[-1]]
+        return {
+            "count": self.total,
+            "mean": self.sum / self.total if self.total else 0.0,
+            "max": self.max,
+            "buckets": [[label, count] for label, count in zip(labels, self.counts)],
+        }
+
+METRICS = (("latency_ms", BUCKETS_MS), ("sql_count", BUCKETS_COUNT), ("sql_ms", BUCKETS_MS), ("parse_query_ms", BUCKETS_MS))
+
+_stats = {}
+_stats_lock = threading.Lock()
+_local = threading.local()
+
+def record(name, values):
+    """ adds values, a dict with a value for each metric, to the histograms of the URL called name """
+    _stats_lock.acquire()
+    try:
+        histograms = _stats.get(name)
+        if histograms is None:
+            histograms = _stats[name] = dict((metric, Histogram(bounds)) for metric, bounds in METRICS)
+        for metric, value in values.items():
+            histograms[metric].add(value)
+    finally:
+        _stats_lock.release()
+
+def get_stats():
+    """ Returns {URL name: {metric: histogram dict}} """
+    _stats_lock.acquire()
+    try:
+        return dict((name, dict((metric, histogram.as_dict()) for metric, histogram in histograms.items()))
+                    for name, histograms in _stats.items())
+    finally:
+        _stats_lock.release()
+
+def reset_stats():
+    _stats_lock.acquire()
+    try:
+        _stats.clear()
+    finally:
+        _stats_lock.release()
+
+def timed(name):
+    """
+    Decorator adding the time spent in the function to the request's timer called name, while the middleware
+    measures a request. Returns the function itself when instrumentation is off.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+        def wrapper(*args, **kwargs):
+            timers = getattr(_local, 'timers', None)
+            if timers is None:
+                return func(*args, **kwargs)
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timers[name] = timers.get(name, 0.0) + default_timer() - start
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        # keeps memoize's uncached, cache_info and cache_clear
+        wrapper.__dict__.update(func.__dict__)
+        return wrapper
+    return decorator
+
+class InstrumentMiddleware(object):
+    def __init__(self):
+        if not ENABLED:
+            raise MiddlewareNotUsed()
+
+    def process_request(self, request):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if not match.url_name or not match.func.__module__.startswith('courses.'):
+            return None
+        request._courses_instrument = (match.url_name, default_timer(), len(connection.queries), connection.use_debug_cursor)
+        connection.use_debug_cursor = True
+        _local.timers = {}
+        return None
+
+    def process_response(self, request, response):
+        state = getattr(request, '_courses_instrument', None)
+        if state is None:
+            return response
+        name, start, queries_before, use_debug_cursor = state
+        if response._base_content_is_iter:
+            # a streamed response runs its queries as it is written out, after the middleware; measure them now
+            response.content = response.content
+        queries = connection.queries[queries_before:]
+        connection.use_debug_cursor = use_debug_cursor
+        timers = getattr(_local, 'timers', None) or {}
+        _local.timers = None
+        record(name, {
+            "latency_ms": (default_timer() - start) * 1e3,
+            "sql_count": len(queries),
+            "sql_ms": sum([float(query.get('time') or 0) for query in queries]) * 1e3,
+            "parse_query_ms": timers.get('parse_query', 0.0) * 1e3,
+        })
+        return response
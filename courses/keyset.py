@@ -0,0 +1,66 @@
+"""
+Keyset pagination for course listings.
+
+Instead of an offset, a page is asked for with an opaque cursor naming the
+last course already shown by its (department_abbr, integer_number,
+coursenumber, id) key, which is Course.Meta.ordering with the id as a tie
+breaker.  The next page is the courses after that key, read off the
+courses_course_keyset index of sql/course.sql, so "load more" costs the same
+at any depth, and stays correct while courses are added or removed between
+pages.
+
+Cursors are signed, so they can be passed through URLs as they are.
+"""
+from django.core import signing
+from django.db.models.query import Q
+
+__all__ = ["KEYSET_FIELDS", "encode_cursor", "decode_cursor", "keyset_q", "keyset_page"]
+
+KEYSET_FIELDS = ('department_abbr', 'integer_number', 'coursenumber', 'id')
+
+SALT = 'courses.keyset'
+
+def encode_cursor(key):
+    """ The cursor for the courses after key, a (department_abbr, integer_number, coursenumber, id) tuple """
+    return signing.dumps(list(key), salt=SALT)
+
+def decode_cursor(cursor):
+    """ The key encode_cursor encoded in cursor; raises ValueError for a cursor it did not make """
+    try:
+        key = signing.loads(cursor, salt=SALT)
+    except signing.BadSignature:
+        raise ValueError("Invalid cursor %r" % cursor)
+    if not isinstance(key, list) or len(key) != len(KEYSET_FIELDS):
+        raise ValueError("Invalid cursor %r" % cursor)
+    return tuple(key)
+
+def keyset_q(key):
+    """
+    The courses ordered after key: the row comparison (department_abbr, integer_number, coursenumber, id) > key,
+    spelled out so every database can run it, with the bound on department_abbr that lets it use the index as a range.
+    """
+    department_abbr, integer_number, coursenumber, id = key
+    after = Q(department_abbr__gt=department_abbr)
+    after |= Q(department_abbr=department_abbr, integer_number__gt=integer_number)
+    after |= Q(department_abbr=department_abbr, integer_number=integer_number, coursenumber__gt=coursenumber)
+    after |= Q(department_abbr=department_abbr, integer_number=integer_number, coursenumber=coursenumber, id__gt=id)
+    return Q(department_abbr__gte=department_abbr) & after
+
+def keyset_page(queryset, limit, cursor=None, fields=None):
+    """
+    The courses of queryset after cursor, at most limit of them, in keyset order, and the cursor for the page after,
+    or None on the last page. With fields, returns tuples of those fields instead of courses.
+    """
+    queryset = queryset.order_by(*KEYSET_FIELDS)
+    if cursor:
+        queryset = queryset.filter(keyset_q(decode_cursor(cursor)))
+    if fields:
+        rows = list(queryset.values_list(*(KEYSET_FIELDS + tuple(fields)))[:limit + 1])
+        keys = [row[:len(KEYSET_FIELDS)] for row in rows]
+        rows = [row[len(KEYSET_FIELDS):] for row in rows]
+    else:
+        rows = list(queryset[:limit + 1])
+        keys = [tuple([getattr(course, name) for name in KEYSET_FIELDS]) for course in rows]
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(keys[limit - 1])
+    return rows, None
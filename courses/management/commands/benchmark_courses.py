@@ -0,0 +1,29 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from courses.benchmark import bench_suite
+
+class Command(NoArgsCommand):
+    help = ("Times the course and instructor searches and the autocomplete views on a synthetic schedule, "
+            "printing JSON. The schedule is rolled back afterwards; run against a scratch (SQLite) database.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--departments', type='int', dest='departments', default=50,
+            help='Number of synthetic departments.'),
+        make_option('--courses', type='int', dest='courses', default=5000,
+            help='Number of synthetic courses.'),
+        make_option('--klasses', type='int', dest='klasses', default=20000,
+            help='Number of synthetic klasses.'),
+        make_option('--instructors', type='int', dest='instructors', default=3000,
+            help='Number of synthetic instructors.'),
+        make_option('--repeat', type='int', dest='repeat', default=3,
+            help='Number of times each query is timed.'),
+        make_option('--seed', type='int', dest='seed', default=0,
+            help='Seed of the synthetic names and queries, so runs can be compared.'),
+    )
+
+    def handle_noargs(self, **options):
+        result = bench_suite(departments=options['departments'], courses=options['courses'], klasses=options['klasses'],
+                             instructors=options['instructors'], repeat=options['repeat'], seed=options['seed'])
+        print json.dumps(result, indent=2, sort_keys=True)
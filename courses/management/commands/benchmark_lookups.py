@@ -0,0 +1,27 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from courses.benchmark import bench_normalized_lookups
+
+class Command(NoArgsCommand):
+    help = ("Compares iexact course lookups with the normalized search columns on a synthetic catalog. "
+            "The catalog is rolled back afterwards; run against a scratch database.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--courses', type='int', dest='courses', default=100000,
+            help='Number of synthetic courses.'),
+        make_option('--repeat', type='int', dest='repeat', default=20,
+            help='Number of times each lookup is timed.'),
+    )
+
+    def handle_noargs(self, **options):
+        result = bench_normalized_lookups(courses=options['courses'], repeat=options['repeat'])
+        print "%d courses" % result.pop("courses")
+        for name, lookup in sorted(result.items()):
+            print "%s: %.2fms before, %.2fms after" % (name, lookup["before_ms"], lookup["after_ms"])
+            print "  before plan:"
+            for row in lookup["before_plan"]:
+                print "    %s" % (row,)
+            print "  after plan:"
+            for row in lookup["after_plan"]:
+                print "    %s" % (row,)
@@ -0,0 +1,23 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from courses.benchmark import bench_parse_query
+from courses.memoize import memoize_stats
+
+class Command(NoArgsCommand):
+    help = ("Times Course parse_query against the regex cascade on a corpus of autocomplete queries, "
+            "and prints the hits and misses of the memoized helpers.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--repeat', type='int', dest='repeat', default=1000,
+            help='Number of passes over the corpus.'),
+    )
+
+    def handle_noargs(self, **options):
+        result = bench_parse_query(repeat=options['repeat'])
+        print "%(queries)d queries: regex %(regex_us).2fus, resolver %(resolver_us).2fus per query (%(speedup).1fx)" % result
+        print "memoized: %(memoized_us).2fus per query, %(memoized_hits)d hits, %(memoized_misses)d misses" % result
+        stats = memoize_stats()
+        for name in sorted(stats):
+            info = stats[name]
+            print "%s: %d hits, %d misses, %d/%d entries" % (name, info["hits"], info["misses"], info["size"], info["maxsize"])
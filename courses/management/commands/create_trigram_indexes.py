@@ -0,0 +1,28 @@
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection, transaction
+
+from courses.models import Department, Course, Subject
+
+SEARCH_FIELDS = ((Department, 'name'), (Course, 'name'), (Subject, 'name'))
+
+class Command(NoArgsCommand):
+    help = ("Creates the pg_trgm extension and GIN indexes used by the PostgreSQL search backend. Run before setting "
+            "COURSES_SEARCH_BACKEND = 'courses.search.PostgresTrigramSearchBackend'.")
+
+    def handle_noargs(self, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Trigram indexes are only supported on PostgreSQL")
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for model, field in SEARCH_FIELDS:
+            table = model._meta.db_table
+            column = model._meta.get_field(field).column
+            name = "%s_%s_trgm" % (table, column)
+            cursor.execute("SELECT 1 FROM pg_class WHERE relname = %s", [name])
+            if cursor.fetchone():
+                continue
+            cursor.execute("CREATE INDEX %s ON %s USING gin (%s gin_trgm_ops)" % (qn(name), qn(table), qn(column)))
+            if int(options.get('verbosity', 1)) > 0:
+                print "Created %s" % name
+        transaction.commit_unless_managed()
@@ -0,0 +1,39 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.importer import import_catalog
+
+class Command(BaseCommand):
+    args = "<file>"
+    help = "Imports a schedule dump of courses, klasses and instructors (see courses.importer for the format)."
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+            help="'csv' or 'json'; guessed from the file extension by default."),
+        make_option('--batch-size', type='int', dest='batch_size', default=500,
+            help='Number of records written per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: import_catalog %s" % self.args)
+        path = args[0]
+        format = options['format'] or ('json' if path.endswith('.json') else 'csv')
+        if format not in ('csv', 'json'):
+            raise CommandError("Unknown format '%s'" % format)
+        verbose = int(options.get('verbosity', 1)) > 0
+
+        def progress(stats):
+            if verbose:
+                print "%(records)d records in %(elapsed).1fs (%(rate).0f/s)" % stats
+
+        f = open(path, 'rb' if format == 'csv' else 'r')
+        try:
+            stats = import_catalog(f, format=format, batch_size=options['batch_size'], progress=progress)
+        finally:
+            f.close()
+        if verbose:
+            print ("Courses: %(courses_created)d created, %(courses_updated)d updated. "
+                   "Klasses: %(klasses_created)d created, %(klasses_updated)d updated. "
+                   "Instructors: %(instructors_created)d created, %(instructor_links_created)d klass links. "
+                   "Skipped %(skipped)d records." % stats)
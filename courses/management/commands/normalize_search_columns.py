@@ -0,0 +1,33 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from courses.models import Department, Course, normalize_search
+from courses.index import MAX_IN_IDS
+
+def backfill(queryset, source, target):
+    """
+    Sets the target column to normalize_search of the source column, with one UPDATE per distinct normalized
+    value (per MAX_IN_IDS source values) instead of one per row. Returns the number of UPDATEs.
+    """
+    by_normalized = {}
+    for value in queryset.order_by().values_list(source, flat=True).distinct():
+        by_normalized.setdefault(normalize_search(value), []).append(value)
+    updates = 0
+    for normalized, values in by_normalized.items():
+        for start in range(0, len(values), MAX_IN_IDS):
+            queryset.filter(**{source + '__in': values[start:start + MAX_IN_IDS]}).update(**{target: normalized})
+            updates += 1
+    return updates
+
+class Command(NoArgsCommand):
+    help = ("Fills the search_* columns of existing departments and courses. "
+            "Run after adding the columns and the indexes printed by 'sqlcustom courses'.")
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        updates = backfill(Department.all.all(), 'name', 'search_name')
+        for source, target in (('department_abbr', 'search_department_abbr'), ('coursenumber', 'search_coursenumber'),
+                               ('number', 'search_number')):
+            updates += backfill(Course.objects.all(), source, target)
+        if int(options.get('verbosity', 1)) > 0:
+            print "Normalized %d departments and %d courses in %d updates" % (Department.all.count(), Course.objects.count(), updates)
@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+
+from courses.models import Department, Course
+from courses.exams import rebuild_leaderboard
+
+class Command(NoArgsCommand):
+    help = "Recomputes the top departments and courses by published exams, which exam bulk updates leave stale."
+
+    def handle_noargs(self, **options):
+        for model in (Department, Course):
+            rows, complete = rebuild_leaderboard(model)
+            if int(options.get('verbosity', 1)) > 0:
+                print "Rebuilt the %s leaderboard with %d rows" % (model._meta.verbose_name, len(rows))
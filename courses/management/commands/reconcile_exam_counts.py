@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+
+from courses.models import Department, Course
+from courses.exams import reconcile_exam_counts
+
+class Command(NoArgsCommand):
+    help = "Recomputes the published_exams counters of departments and courses, which exam bulk updates leave stale."
+
+    def handle_noargs(self, **options):
+        for model in (Department, Course):
+            count = reconcile_exam_counts(model)
+            if int(options.get('verbosity', 1)) > 0:
+                print "Corrected the published exam count of %d %s" % (count, model._meta.verbose_name_plural)
@@ -0,0 +1,20 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from courses.models import Klass
+
+class Command(NoArgsCommand):
+    help = "Fills Klass.cached_instructor_names in bulk."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Recompute the names of every klass, not just the ones never computed.'),
+    )
+
+    def handle_noargs(self, **options):
+        klasses = Klass.objects.all()
+        if not options['all']:
+            klasses = klasses.filter(cached_instructor_names__isnull=True)
+        count = Klass.objects.refresh_instructor_names(klasses)
+        if int(options.get('verbosity', 1)) > 0:
+            print "Refreshed instructor names for %d klasses" % count
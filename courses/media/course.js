@@ -51,3 +51,110 @@ function courselist_result(data, list_series) {
     elementlist.add_element_to_list(list_series, data[1], data[0]);
     return;
 }
+
+/* the catalog bundle (see courses/bundle.py), for autocompleting without a request per keystroke */
+var catalog = catalog || {};
+catalog.data = null;
+catalog.waiting = null;
+
+catalog.normalize = function(value) {
+    return $.trim(value || '').replace(/\s+/g, ' ').toUpperCase();
+}
+
+/* calls callback with the indexed bundle, loading it once per page */
+catalog.load = function(url, callback) {
+    if (catalog.data) {
+        callback(catalog.data);
+        return;
+    }
+    if (catalog.waiting) {
+        catalog.waiting.push(callback);
+        return;
+    }
+    catalog.waiting = [callback];
+    $.ajax({ url : url, dataType : 'json', cache : true, success : function(bundle) {
+        catalog.data = catalog.index(bundle);
+        var waiting = catalog.waiting;
+        catalog.waiting = null;
+        $.each(waiting, function(i, f) { f(catalog.data); });
+    }});
+}
+
+catalog.index = function(bundle) {
+    var data = { departments : [], by_key : {}, courses : {} };
+    // bundle.departments are [id, name, nice abbr, [abbrs]]; a name wins over an abbreviation, as on the server
+    $.each(bundle.departments, function(i, d) {
+        data.departments.push([d[1], d[0], d[3].join(' ')]);
+        data.courses[d[0]] = [];
+        $.each(d[3], function(j, abbr) {
+            data.by_key[catalog.normalize(abbr)] = d;
+        });
+    });
+    $.each(bundle.departments, function(i, d) {
+        data.by_key[catalog.normalize(d[1])] = d;
+    });
+    // bundle.courses are [department id, id, coursenumber, name]
+    $.each(bundle.courses, function(i, c) {
+        data.courses[c[0]].push(c);
+    });
+    return data;
+}
+
+/* department rows are [name, id, abbrs], matched on the name and the abbreviations */
+catalog.department_autocomplete = function(input, url) {
+    catalog.load(url, function(data) {
+        input.autocomplete(data.departments, {
+            matchContains : true,
+            formatItem : function(row) { return row[0]; },
+            formatMatch : function(row) { return row[0] + ' ' + row[2]; }
+        });
+    });
+}
+
+/* course rows are [coursenumber, id], or [coursenumber: name, short name,,id] with abbrs, as coursenumber_autocomplete returns */
+catalog.coursenumber_autocomplete = function(input, department_input, url, abbrs) {
+    catalog.load(url, function(data) {
+        var rows = function() {
+            var d = data.by_key[catalog.normalize(department_input.attr('value'))];
+            if (!d) {
+                return [];
+            }
+            return $.map(data.courses[d[0]], function(c) {
+                if (abbrs) {
+                    return [[c[2] + ': ' + c[3], d[2] + ' ' + c[2] + ',,' + c[1]]];
+                }
+                return [[c[2], c[1]]];
+            });
+        };
+        input.autocomplete(rows(), {
+            matchContains : true,
+            formatItem : function(row) { return row[0]; }
+        });
+        department_input.bind('result', function() {
+            input.setOptions({ data : rows() });
+        }).blur(function() {
+            input.setOptions({ data : rows() });
+        });
+    });
+}
+
+/* keeps the id of the chosen row in the hidden input until the text is edited */
+catalog.keep_id = function(input, hidden) {
+    var chosen = input.attr('value');
+    input.result(function(event, data, formatted) {
+        hidden.attr('value', data[1]);
+        chosen = input.attr('value');
+    }).keyup(function() {
+        if (input.attr('value') != chosen) {
+            hidden.attr('value', '');
+        }
+    });
+}
+
+/* replaces the "load more" link of the course finder with the next page of courses, found after cursor */
+function find_course_more(link, url, query, cursor) {
+    $(link).text('Loading...');
+    $.get(url, { q : query, cursor : cursor }, function(html) {
+        $(link).replaceWith(html);
+    });
+}
@@ -0,0 +1,104 @@
+"""
+Bounded LRU memoization for the pure query parsing helpers.
+
+Every memoized function is registered by name, so memoize_stats() can report
+its hits and misses for the whole process.
+"""
+import threading
+
+from django.conf import settings
+
+__all__ = ["memoize", "memoize_stats", "clear_memoized"]
+
+DEFAULT_SIZE = getattr(settings, 'COURSES_MEMOIZE_SIZE', 1024)
+
+_registry = {}
+
+# fields of a linked list node
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+class LRUCache(object):
+    """ Maps keys to values, dropping the least recently used key past maxsize """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.map = {}
+            # circular doubly linked list, most recently used right after root
+            self.root = []
+            self.root[:] = [self.root, self.root, None, None]
+        finally:
+            self.lock.release()
+
+    def get_or_compute(self, key, compute):
+        self.lock.acquire()
+        try:
+            link = self.map.get(key)
+            if link is not None:
+                self.hits += 1
+                prev, next = link[PREV], link[NEXT]
+                prev[NEXT], next[PREV] = next, prev
+                self._push(link)
+                return link[VALUE]
+            self.misses += 1
+        finally:
+            self.lock.release()
+
+        value = compute()
+
+        self.lock.acquire()
+        try:
+            if key not in self.map:
+                if len(self.map) >= self.maxsize:
+                    oldest = self.root[PREV]
+                    oldest[PREV][NEXT] = self.root
+                    self.root[PREV] = oldest[PREV]
+                    del self.map[oldest[KEY]]
+                link = [None, None, key, value]
+                self._push(link)
+                self.map[key] = link
+        finally:
+            self.lock.release()
+        return value
+
+    def _push(self, link):
+        first = self.root[NEXT]
+        link[PREV], link[NEXT] = self.root, first
+        first[PREV] = self.root[NEXT] = link
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.map), "maxsize": self.maxsize}
+
+def memoize(maxsize=DEFAULT_SIZE, name=None):
+    """
+    Decorator memoizing a function of hashable positional arguments in an LRU cache of maxsize entries;
+    calls with keyword arguments are not cached.
+    The decorated function has cache_info(), cache_clear() and the undecorated function as uncached.
+    """
+    def decorator(func):
+        cache = LRUCache(maxsize)
+        def wrapper(*args, **kwargs):
+            if kwargs:
+                return func(*args, **kwargs)
+            return cache.get_or_compute(args, lambda: func(*args))
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.uncached = func
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = cache.clear
+        _registry[name or "%s.%s" % (func.__module__, func.__name__)] = cache
+        return wrapper
+    return decorator
+
+def memoize_stats():
+    """ Returns {name: {hits, misses, size, maxsize}} for every memoized function """
+    return dict((name, cache.info()) for name, cache in _registry.items())
+
+def clear_memoized():
+    for cache in _registry.values():
+        cache.clear()
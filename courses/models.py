@@ -1,16 +1,35 @@
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Count
 from django.db.models.query import QuerySet
 from django.db.models.query import Q
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete, m2m_changed
 from django.conf import settings
 from nice_types.db import QuerySetManager, CachingManager
 from nice_types.semester import SemesterField, Semester
 from courses.constants import PREFIX, SUFFIX, DEPT_ABBRS, DEPT_ABBRS_INV, DEPT_ABBRS_SET
-import re, datetime
+from courses.index import get_course_index, invalidate_course_index, MAX_IN_IDS
+from courses.instructor_index import get_instructor_index, invalidate_instructor_index
+from courses.cache import cached, bump_version, bump_model_version, bump_instructor_version
+from courses.search import get_search_backend, invalidate_search_index
+from courses.resolver import get_department_resolver
+from courses.memoize import memoize
+from courses.instrument import timed
+from courses.slowlog import watch
+from courses.keyset import keyset_page, encode_cursor, decode_cursor
+from courses.exams import top_by_published_exams, annotate_exam_counters, connect_exam_receivers
+import re
+from itertools import groupby
+from bisect import bisect_right
 
 class DeletionException(Exception):
     pass
 
+def normalize_search(value):
+    """ uppercases value and collapses its whitespace, for the indexed search_* columns """
+    if value is None:
+        return None
+    return u" ".join(value.split()).upper()
+
 class NoDeleteQuerySet(QuerySet):
     def delete(self, force_delete=False):
         if not force_delete:
@@ -26,10 +45,55 @@ class CourseManager(QuerySetManager):
 
     def ft_query(self, *args, **kwargs):
         return self.get_query_set().ft_query(*args, **kwargs)
+
+    def ft_query_page(self, query, limit, offset=0, fields=None):
+        """ 
+        Returns a list of at most limit courses matching query, using the course index if enabled.
+        With fields, returns tuples of those fields instead of courses.
+        """
+        index = get_course_index()
+        if index is None:
+            courses = self.ft_query(query)
+            if fields:
+                courses = courses.values_list(*fields)
+            return list(courses[offset:offset + limit])
+        ids = index.search(*self.parse_query(query))
+        return index.fetch(ids[offset:offset + limit], fields)
+
+    def ft_query_after(self, query, limit, cursor=None, fields=None):
+        """
+        ft_query_page with keyset pagination: returns at most limit courses matching query after cursor, and the
+        cursor for the next page, or None on the last page. See courses.keyset.
+        """
+        index = get_course_index()
+        if index is None:
+            return keyset_page(self.ft_query(query), limit, cursor, fields)
+        keys = index.search_keys(*self.parse_query(query))
+        start = 0
+        if cursor:
+            key = decode_cursor(cursor)
+            start = bisect_right(keys, (key[:3], key[3]))
+        page = keys[start:start + limit + 1]
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1][0] + (page[-1][1],))
+        return index.fetch([id for sort_key, id in page], fields), next_cursor
+
+    def cached_ft_query(self, query, limit):
+        """ (department_abbr, coursenumber, id) of the ft_query_page courses, cached until a course or department changes """
+        return cached('course-ft-query-rows', ('course', 'department'), (query, limit),
+                      lambda: self.ft_query_page(query, limit, fields=('department_abbr', 'coursenumber', 'id')))
         
     def query_exact(self, *args, **kwargs):
         return self.get_query_set().query_exact(*args, **kwargs)
 
+    def ft_query_name_fuzzy(self, *args, **kwargs):
+        return self.get_query_set().ft_query_name_fuzzy(*args, **kwargs)
+
+    def rank_name(self, *args, **kwargs):
+        return self.get_query_set().rank_name(*args, **kwargs)
+
 class AllDepartmentManager(QuerySetManager):
     def ft_query(self, *args, **kwargs):
         return self.get_query_set().ft_query(*args, **kwargs)
@@ -42,6 +106,21 @@ class AllDepartmentManager(QuerySetManager):
     def ft_query_name_fuzzy(self, *args, **kwargs):
         return self.get_query_set().ft_query_name_fuzzy(*args, **kwargs)
 
+    def rank_name(self, *args, **kwargs):
+        return self.get_query_set().rank_name(*args, **kwargs)
+
+    def cached_autocomplete(self, q):
+        """ 
+        (name, id) of the departments matching q by abbreviation, or failing that by name;
+        cached until a department changes
+        """
+        def query():
+            depts = list(self.ft_query(q).values_list('name', 'id'))
+            if len(depts) == 0:
+                depts = self.rank_name(q, values=('name', 'id'))
+            return depts
+        return cached('department-autocomplete-rows', ('department',), (self.__class__.__name__, q), query)
+
     def annotate_exam_count(self, *args, **kwargs):
         return self.get_query_set().annotate_exam_count(*args, **kwargs)
 
@@ -69,7 +148,11 @@ class Subject(models.Model):
     major = models.BooleanField()
         
     def __unicode__(self):
-        return u'%s: %s' % ('Major' if self.major else 'Minor', self.name)
+        return Subject.format_name(self.name, self.major)
+
+    @staticmethod
+    def format_name(name, major):
+        return u'%s: %s' % ('Major' if major else 'Minor', name)
 
 class Department(models.Model):
     """ Models one of the academic departments. """
@@ -84,9 +167,15 @@ class Department(models.Model):
     abbr = models.CharField(max_length = 10, unique = True)
     """ PROPER Department abbreviation: COMPSCI, PHYSICS, MATH, etc."""
 
+    search_name = models.CharField(max_length = 150, db_index = True, editable = False)
+    """ name normalized with normalize_search, so name lookups can use an index """
+
     hidden = models.BooleanField()
     """ if this department is hidden """
 
+    published_exams = models.IntegerField(default = 0, db_index = True, editable = False)
+    """ number of published exams, kept by the exam receivers in courses.exams """
+
     @property    
     def nice_abbr(self):
         return Department.get_nice_abbr(self.abbr)
@@ -105,16 +194,22 @@ class Department(models.Model):
             abbrs.remove(self.nice_abbr)
         return abbrs
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_search(self.name)
+        super(Department, self).save(*args, **kwargs)
+
     def published_exam_count(self):
-        return self.exam_set.filter(publishable=True).count()
+        return self.published_exams
     
     @staticmethod
+    @memoize(name='Department.get_nice_abbr')
     def get_nice_abbr(abbr):
         """ replaces COMPSCI (correct abbreviation) with CS (common abbreviation) and the like """
         return DEPT_ABBRS.get(abbr.upper(), (abbr.upper(),))[0]
 
 
     @staticmethod
+    @memoize(name='Department.get_proper_abbr')
     def get_proper_abbr(abbr):
         """ replaces CS (common abbreviation) with COMPSCI (correct abbreviation) and the like """    
         if abbr:
@@ -129,20 +224,29 @@ class Department(models.Model):
             return self.filter(abbr = Department.get_proper_abbr(abbr))
         
         def ft_query_name(self, name):
-            return self.filter(name__iexact = name)
+            return self.filter(search_name = normalize_search(name))
 
         def ft_query_name_fuzzy(self, name):
-            return self.filter(name__icontains = name)
+            return self.filter(get_search_backend().match(Department, 'name', name))
+
+        def rank_name(self, name, limit=None, values=None):
+            """ ft_query_name_fuzzy as a list, best match first """
+            return get_search_backend().rank(self, 'name', name, limit, values)
 
         def ft_query_all(self, q):
-            return self.filter(Q(name__icontains = q) | Q(abbr = Department.get_proper_abbr(q)))
+            return watch(self.filter(get_search_backend().match(Department, 'name', q) | Q(abbr = Department.get_proper_abbr(q))), 'Department.ft_query_all', q)
 
-        def annotate_exam_count(self, publishable = True):
+        def annotate_exam_count(self, publishable = True, counters = False):
+            """ with counters, reads the published exam counts from the published_exams counters instead of joining """
+            if counters and publishable:
+                return annotate_exam_counters(self)
             return self.filter(exam__publishable=publishable).annotate(exam_count=Count('exam'))
 
         def get_top_departments_by_published_exams(self,n=10):
-            departments = list(self.annotate_exam_count(True).order_by("-exam_count", "name")[:n])
-            departments = filter(lambda x: x.exam_count > 0, departments)
+            departments = top_by_published_exams(self, n)
+            if departments is None:
+                departments = list(self.annotate_exam_count(True).order_by("-exam_count", "name")[:n])
+                departments = filter(lambda x: x.exam_count > 0, departments)
             return departments
 
 
@@ -180,8 +284,21 @@ class Course(models.Model):
     
     description = models.TextField()
     """ A description of the course """
+
+    search_department_abbr = models.CharField(max_length = 10, editable = False)
+    """ department_abbr normalized with normalize_search; indexed with the columns below in sql/course.sql """
+
+    search_coursenumber = models.CharField(max_length = 10, editable = False)
+    """ coursenumber normalized with normalize_search """
+
+    search_number = models.CharField(max_length = 10, editable = False)
+    """ number normalized with normalize_search """
+
+    published_exams = models.IntegerField(default = 0, db_index = True, editable = False)
+    """ number of published exams, kept by the exam receivers in courses.exams """
     
     @staticmethod
+    @memoize(name='Course.split_coursenumber')
     def split_coursenumber(coursenumber):
         prefix = suffix = ""
         number = coursenumber.upper()
@@ -206,10 +323,15 @@ class Course(models.Model):
         return u'%s%s %s' % (Department.get_nice_abbr(self.department_abbr), self.coursenumber, self.name)
 
     def short_name(self, space = False):
+        return Course.format_short_name(self.department_abbr, self.coursenumber, space)
+
+    @staticmethod
+    def format_short_name(department_abbr, coursenumber, space = False):
+        """ short_name from raw column values """
         if space:
-            return "%s %s" % (Department.get_nice_abbr(self.department_abbr), self.coursenumber)
+            return "%s %s" % (Department.get_nice_abbr(department_abbr), coursenumber)
         else:
-            return "%s%s" % (Department.get_nice_abbr(self.department_abbr), self.coursenumber)
+            return "%s%s" % (Department.get_nice_abbr(department_abbr), coursenumber)
 
     def short_name_space(self):
         return self.short_name(True)
@@ -224,7 +346,18 @@ class Course(models.Model):
                          re.compile(r'(?P<dept>[-,A-Za-z_\.& ]+)(?P<course>\d\w*)'),  # matches "CS61A"
                          re.compile(r'(?P<dept>[-,A-Za-z_\.& ]+)'),  # matches "CS"
                          )    
-        def parse_query(self, query):
+        @staticmethod
+        @timed('parse_query')
+        @memoize(name='Course.parse_query')
+        def parse_query(query):
+            parsed = get_department_resolver().parse(query)
+            if parsed is not None:
+                return parsed
+            return Course.QuerySet.parse_query_regex(query)
+
+        @staticmethod
+        def parse_query_regex(query):
+            """ parse_query for departments the resolver doesn't know, trying each of course_patterns """
             for course_pattern in Course.QuerySet.course_patterns:
                 m = course_pattern.match(query)
                 if m:
@@ -245,40 +378,67 @@ class Course(models.Model):
             return m.groupdict().get('dept'), m.groupdict().get('course')
             
         def get_canonical(self, query):
-            print query
             abbr, coursenumber = self.parse_canonical(query)
-            return self.get(department_abbr__iexact=abbr, coursenumber__iexact=coursenumber)
+            return self.get(search_department_abbr=normalize_search(abbr), search_coursenumber=normalize_search(coursenumber))
 
-        def query_coursenumber(self, coursenumber):
+        @staticmethod
+        def coursenumber_q(coursenumber, related=''):
+            """ the query_coursenumber conditions, on the course reached through related (e.g. 'course__') """
             prefix, number, suffix = Course.split_coursenumber(coursenumber)
-            self = self.filter(number__istartswith = number)
+            q = Q(**{related + 'search_number__startswith': normalize_search(number)})
             if len(prefix) > 0:
-                self = self.filter(prefix=prefix.upper())
+                q &= Q(**{related + 'prefix': prefix.upper()})
             if len(suffix) > 0:
-                self = self.filter(suffix=suffix.upper())                    
-            return self
-        
-        def ft_query(self, query):
-            (dept_abbr, coursenumber) = self.parse_query(query)
-        
-            self = self.filter(department_abbr__iexact = dept_abbr)        
+                q &= Q(**{related + 'suffix': suffix.upper()})
+            return q
+
+        def query_coursenumber(self, coursenumber):
+            return self.filter(Course.QuerySet.coursenumber_q(coursenumber))
+
+        @staticmethod
+        def ft_query_q(query, related=''):
+            """ the ft_query conditions, on the course reached through related, so other models can join on them """
+            (dept_abbr, coursenumber) = Course.QuerySet.parse_query(query)
+
+            index = get_course_index()
+            if index is not None:
+                ids = index.search(dept_abbr, coursenumber)
+                if len(ids) <= MAX_IN_IDS:
+                    return Q(**{related + 'id__in': ids})
+
+            q = Q(**{related + 'search_department_abbr': normalize_search(dept_abbr)})
             if coursenumber:
-                self = self.query_coursenumber(coursenumber)
-            return self
+                q &= Course.QuerySet.coursenumber_q(coursenumber, related)
+            return q
+
+        def ft_query(self, query):
+            return watch(self.filter(Course.QuerySet.ft_query_q(query)), 'Course.ft_query', query)
         
+        def ft_query_name_fuzzy(self, name):
+            return self.filter(get_search_backend().match(Course, 'name', name))
+
+        def rank_name(self, name, limit=None, values=None):
+            """ ft_query_name_fuzzy as a list, best match first """
+            return get_search_backend().rank(self, 'name', name, limit, values)
+
         def query_exact(self, dept_abbr, coursenumber, number=False):
             dept_abbr = Department.get_proper_abbr(dept_abbr)
             if not number:
-                return self.filter(department_abbr__iexact = dept_abbr, coursenumber__iexact = coursenumber)
+                return self.filter(search_department_abbr = normalize_search(dept_abbr), search_coursenumber = normalize_search(coursenumber))
             else:
-                return self.filter(department_abbr__iexact = dept_abbr, number__iexact = coursenumber)      
+                return self.filter(search_department_abbr = normalize_search(dept_abbr), search_number = normalize_search(coursenumber))      
             
-        def annotate_exam_count(self, publishable = True):
+        def annotate_exam_count(self, publishable = True, counters = False):
+            """ with counters, reads the published exam counts from the published_exams counters instead of joining """
+            if counters and publishable:
+                return annotate_exam_counters(self)
             return self.filter(exam__publishable=publishable).annotate(exam_count=Count('exam'))
 
         def get_top_courses_by_published_exams(self,n=10):
-            courses = list(self.annotate_exam_count(True).order_by("-exam_count", "name")[:n])
-            courses = filter(lambda x: x.exam_count > 0, courses)
+            courses = top_by_published_exams(self, n)
+            if courses is None:
+                courses = list(self.annotate_exam_count(True).order_by("-exam_count", "name")[:n])
+                courses = filter(lambda x: x.exam_count > 0, courses)
             # this sort will get e..g 61A 61B 61C in order
             courses.sort(key=lambda x: x.number)
             # hopefully this is a stable sort... this will sort the rest
@@ -286,7 +446,8 @@ class Course(models.Model):
             return courses
 
     INTEGER_PATTERN = re.compile("(?P<integer>\d+)")
-    def save(self, *args, **kwargs):
+    def fill_derived_fields(self):
+        """ fills the fields computed from department and coursenumber; done by save """
         if not self.department_abbr:
             self.department_abbr = self.department.abbr
         self.coursenumber = self.coursenumber.upper()
@@ -296,6 +457,12 @@ class Course(models.Model):
             self.integer_number = 0
             if m:
                 self.integer_number = int(m.group("integer"))                
+        self.search_department_abbr = normalize_search(self.department_abbr)
+        self.search_coursenumber = normalize_search(self.coursenumber)
+        self.search_number = normalize_search(self.number)
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
         super(Course, self).save(*args, **kwargs)
     def delete(self, *args, **kwargs):
         force = kwargs.pop('force_delete', False)
@@ -312,6 +479,43 @@ class KlassManager(QuerySetManager):
     def ft_query(self, *args, **kwargs):
         return self.get_query_set().ft_query(*args, **kwargs)
 
+    def for_display(self, *args, **kwargs):
+        return self.get_query_set().for_display(*args, **kwargs)
+
+    def in_semesters(self, *args, **kwargs):
+        return self.get_query_set().in_semesters(*args, **kwargs)
+
+    def for_courses(self, *args, **kwargs):
+        return self.get_query_set().for_courses(*args, **kwargs)
+
+    def history(self, *args, **kwargs):
+        return self.get_query_set().history(*args, **kwargs)
+
+    def by_department(self, *args, **kwargs):
+        return self.get_query_set().by_department(*args, **kwargs)
+
+    def refresh_instructor_names(self, queryset=None, chunk_size=500):
+        """ 
+        Recomputes cached_instructor_names for the klasses in queryset (default: all klasses)
+        with one query for the instructor names per chunk, and one UPDATE per distinct value.
+        Returns the number of klasses updated.
+        """
+        if queryset is None:
+            queryset = self.get_query_set()
+        klass_ids = list(queryset.values_list('id', flat=True))
+        through = Instructor.klasses.through
+        for start in range(0, len(klass_ids), chunk_size):
+            chunk = klass_ids[start:start + chunk_size]
+            lasts = dict((klass_id, []) for klass_id in chunk)
+            for klass_id, last in through.objects.filter(klass__in=chunk).order_by('id').values_list('klass', 'instructor__last'):
+                lasts[klass_id].append(last)
+            by_names = {}
+            for klass_id, names in lasts.items():
+                by_names.setdefault(Klass.join_instructor_names(names), []).append(klass_id)
+            for names, ids in by_names.items():
+                self.get_query_set().filter(pk__in=ids).update(cached_instructor_names=names)
+        return len(klass_ids)
+
 class Klass(models.Model):
     objects = KlassManager()
     
@@ -354,11 +558,15 @@ class Klass(models.Model):
     def pretty_semester(self):
         return self.semester.verbose_description()
     
+    @staticmethod
+    def join_instructor_names(lasts):
+        return "; ".join(lasts)[:Klass._meta.get_field('cached_instructor_names').max_length]
+
     def _instructor_names(self):
+        # kept current by Klass.objects.refresh_instructor_names and the m2m_changed receiver;
+        # never saves, so rendering klasses does not write
         if self.cached_instructor_names is None:
-            self.cached_instructor_names = "; ".join([inst.last for inst in self.instructors.all()])
-            # maybe we shouldn't auto save...
-            self.save()
+            self.cached_instructor_names = Klass.join_instructor_names([inst.last for inst in self.instructors.all()])
         return self.cached_instructor_names
     instructor_names = property(_instructor_names)
 
@@ -372,26 +580,81 @@ class Klass(models.Model):
         super(Klass, self).delete(*args, **kwargs)
 
     class QuerySet(NoDeleteQuerySet):
+        def for_display(self):
+            """
+            Loads the course with each klass, and the instructors of all the klasses in one more query,
+            so str() and instructor_names don't query per klass
+            """
+            return self.select_related('course').prefetch_related('instructors')
+
         def ft_query(self, course, semester):
-            season = semester[:2]
-            year = int(semester[2:])
-            if year < 10:
-                year += 2000
-            else:
-                year += 1900
-            year = datetime.date(year=year, month=1, day=1)
-            return self.filter(course__in = Course.objects.ft_query(course), semester=semester)
+            """ klasses of the courses matching the course query in semester, joining the courses """
+            return self.filter(Course.QuerySet.ft_query_q(course, 'course__'), semester=semester)
+
+        def in_semesters(self, first=None, last=None):
+            """ klasses taught from semester first to semester last, both included; either may be left open """
+            if first is not None:
+                self = self.filter(semester__gte=first)
+            if last is not None:
+                self = self.filter(semester__lte=last)
+            return self
+
+        def for_courses(self, courses, first=None, last=None):
+            """
+            klasses of courses (courses or ids) from semester first to last, ordered like the (course, semester,
+            section) index in sql/klass.sql, so one indexed query covers them
+            """
+            ids = [getattr(course, 'pk', course) for course in courses]
+            return self.filter(course__in=ids).in_semesters(first, last).order_by('course__id', 'semester', 'section')
+
+        def history(self, course, first=None, last=None):
+            """ [(semester, [klasses])] of course, oldest first, loaded with for_display in one pass """
+            klasses = self.for_courses([course], first, last).for_display()
+            return [(semester, list(group)) for semester, group in groupby(klasses, lambda klass: klass.semester)]
+
+        def by_department(self, semester):
+            """ [(department abbr, [klasses])] of semester, in course order, loaded with for_display in one pass """
+            klasses = self.filter(semester=semester).for_display().order_by('course__department_abbr', 'course__integer_number',
+                                                                           'course__coursenumber', 'section')
+            return [(abbr, list(group)) for abbr, group in groupby(klasses, lambda klass: klass.course.department_abbr)]
             
     
 class InstructorManager(QuerySetManager):
     def parse_query(self, *args, **kwargs):
         return self.get_query_set().parse_query(*args, **kwargs)
 
+    @transaction.commit_on_success
+    def save_many(self, instructors):
+        """ 
+        Saves instructors in one transaction, with one query for each instructor plus three in total
+        for the home department abbrs and memberships
+        """
+        missing = set([i.home_department_id for i in instructors if not i.home_department_abbr])
+        abbrs = dict(Department.all.filter(pk__in=missing).values_list('id', 'abbr')) if missing else {}
+        for instructor in instructors:
+            if not instructor.home_department_abbr:
+                instructor.home_department_abbr = Department.get_nice_abbr(abbrs[instructor.home_department_id])
+            instructor.save(ensure_home_department=False)
+
+        through = Instructor.departments.through
+        memberships = set(through.objects.filter(instructor__in=[i.pk for i in instructors]).values_list('instructor', 'department'))
+        wanted = set([(i.pk, i.home_department_id) for i in instructors]) - memberships
+        through.objects.bulk_create([through(instructor_id=instructor_id, department_id=department_id) for instructor_id, department_id in wanted])
+        if wanted:
+            # bulk_create sends no m2m_changed, so do what its receivers would
+            bump_version('instructor')
+            invalidate_instructor_index()
+
     def ft_query(self, *args, **kwargs):
+        index = get_instructor_index()
+        if index is not None:
+            ids = index.ft_query(*args, **kwargs)
+            if ids is not None and len(ids) <= MAX_IN_IDS:
+                return self.get_query_set().filter(pk__in=ids)
         return self.get_query_set().ft_query(*args, **kwargs)
 
-    def ft_query_inexact(self, *args, **kwargs):
-        return self.get_query_set().ft_query_inexact(*args, **kwargs)
+    def ft_query_inexact(self, query, course_query=None):
+        return self.ft_query(query, course_query=course_query, last_startswith=True)
 
     def hinted_query(self, *args, **kwargs):
         return self.get_query_set().hinted_query(*args, **kwargs)
@@ -399,6 +662,28 @@ class InstructorManager(QuerySetManager):
     def query_exact(self, *args, **kwargs):
         return self.get_query_set().query_exact(*args, **kwargs)    
 
+    def cached_autocomplete(self, q, course_query, limit):
+        """ 
+        (last, first, home_department_abbr, id) of the instructors whose last name starts with q, hinted by
+        course_query. Falls back to ignoring the hint if nothing matches; cached until an instructor, klass,
+        course or department changes. With the instructor index, the hints are decided in memory and the rows
+        come in name order.
+        """
+        fields = ('last', 'first', 'home_department_abbr', 'id')
+        def query():
+            index = get_instructor_index()
+            if index is not None:
+                ids = index.ft_query(q, course_query=course_query, last_startswith=True)
+                if ids is not None:
+                    if len(ids) == 0 and course_query:
+                        ids = index.ft_query(q, last_startswith=True)
+                    return index.fetch(ids[:limit], fields)
+            instructors = list(self.ft_query_inexact(q, course_query=course_query).values_list(*fields)[:limit])
+            if len(instructors) == 0 and course_query:
+                instructors = list(self.ft_query_inexact(q).values_list(*fields)[:limit])
+            return instructors
+        return cached('instructor-autocomplete-rows', ('instructor', 'klass', 'course', 'department'), (q, course_query, limit), query)
+
 
     
 class Instructor(models.Model):
@@ -441,24 +726,34 @@ class Instructor(models.Model):
         return self.short_name()
     
     def short_name(self, first = False, dept = False):
-        if first or len(self.first) == 0:
-            first = self.first
+        return Instructor.format_short_name(self.last, self.first, self.home_department_abbr, first, dept)
+
+    @staticmethod
+    def format_short_name(last, first_name, home_department_abbr, first = False, dept = False):
+        """ short_name from raw column values """
+        if first or len(first_name) == 0:
+            first = first_name
         else:
-            first = self.first[0]
+            first = first_name[0]
             
             
         if dept:
-            return "%s, %s [%s]" % (self.last, first, self.home_department_abbr)
+            return "%s, %s [%s]" % (last, first, home_department_abbr)
         else:
-            return "%s, %s" % (self.last, first)
+            return "%s, %s" % (last, first)
 
     def save(self, *args, **kwargs):
+        ensure_home_department = kwargs.pop('ensure_home_department', True)
         if not self.home_department_abbr:
             self.home_department_abbr = self.home_department.nice_abbr
         super(Instructor, self).save(*args, **kwargs)
-        if not self.home_department in self.departments.all():
-            self.departments.add(self.home_department)        
-        assert(self.departments.count() > 0)
+        if ensure_home_department:
+            self.ensure_home_department()
+
+    def ensure_home_department(self):
+        """ makes the home department one of the instructor's departments, with at most two queries """
+        # through add(), so the m2m_changed receivers bump the instructor version and drop the instructor index
+        self.departments.add(self.home_department_id)
 
     def delete(self, *args, **kwargs):
         force = kwargs.pop('force_delete', False)
@@ -473,7 +768,10 @@ class Instructor(models.Model):
                          re.compile(r'(?P<first>[\w-]*)\s+(?P<last>[\w-]*)'),                      # matches "Brian Harvey"
                          re.compile(r'(?P<last>[\w-]*)'),                      # matches "Harvey"
                          )
-        def parse_query(self, query):        
+        @staticmethod
+        @timed('parse_query')
+        @memoize(name='Instructor.parse_query')
+        def parse_query(query):        
             for instructor_pattern in Instructor.QuerySet.instructor_patterns:
                 m = instructor_pattern.match(query)
                 if m:
@@ -481,7 +779,26 @@ class Instructor(models.Model):
                     return (d.get("last"), d.get("first"), Department.get_proper_abbr(d.get("dept")))            
             return (None, None, None)
             
-        def hinted_query(self, last_name=None, last_startswith=False, first_name=None, force_first=False, department_abbrs=None, force_departments=False, courses=None, exact=False):
+        def hinted_query(self, last_name=None, last_startswith=False, first_name=None, force_first=False, department_abbrs=None, force_departments=False, courses=None, exact=False, prefetch=None):
+            """
+            Narrows the instructors down by last name, then first name, departments and courses, stopping as soon
+            as a single instructor is left and ignoring hints that match nobody (unless exact). Only courses=None
+            leaves out the courses hint; an empty courses queryset is a hint that matches nobody.
+
+            With prefetch (the default, see COURSES_PREFETCH_HINTED_QUERY) the narrowing is decided in Python from
+            the last-name candidates, so the number of queries does not depend on how far the narrowing goes.
+            """
+            if prefetch is None:
+                prefetch = getattr(settings, 'COURSES_PREFETCH_HINTED_QUERY', True)
+            self = watch(self, 'Instructor.hinted_query', last_name)
+            kwargs = dict(last_name=last_name, last_startswith=last_startswith, first_name=first_name, force_first=force_first,
+                          department_abbrs=department_abbrs, courses=courses, exact=exact)
+            if prefetch and last_name:
+                return self.hinted_query_prefetched(**kwargs)
+            return self.hinted_query_counting(**kwargs)
+
+        def hinted_query_counting(self, last_name=None, last_startswith=False, first_name=None, force_first=False, department_abbrs=None, courses=None, exact=False):
+            """ hinted_query, deciding every step with a COUNT query """
             if last_name:
                 if last_startswith:
                     self = self.filter(last__istartswith=last_name)
@@ -512,7 +829,7 @@ class Instructor(models.Model):
                     elif self.count() == 1:
                        return self
             
-            if courses:
+            if courses is not None:
                 old_self = self
                 self = self.filter(klasses__course__in = courses).distinct()
 
@@ -520,6 +837,65 @@ class Instructor(models.Model):
                    return old_self                
                    
             return self        
+
+        def hinted_query_prefetched(self, last_name, last_startswith=False, first_name=None, force_first=False, department_abbrs=None, courses=None, exact=False):
+            """
+            hinted_query, deciding every step in Python from the last-name candidates.
+
+            Runs one query for the candidates, plus one for their matching departments and one for the courses they
+            taught when those hints are reached; a courses queryset goes into that query as a subquery, without being
+            evaluated. Returns the same queryset hinted_query_counting would.
+            """
+            if last_startswith:
+                self = self.filter(last__istartswith=last_name)
+            else:
+                self = self.filter(last__iexact=last_name)
+            candidates = self
+
+            firsts = dict(self.values_list('id', 'first'))
+            # ids of the rows the current queryset returns; joins on departments can repeat an instructor
+            rows = firsts.keys()
+
+            if not force_first and not exact and len(rows) <= 1:
+                return self
+
+            if first_name:
+                old_self, old_rows = self, rows
+                self = self.filter(first__iexact=first_name)
+                rows = [id for id in old_rows if firsts[id].lower() == first_name.lower()]
+                if len(rows) == 0:
+                    self = old_self.filter(first__istartswith=first_name[0])
+                    rows = [id for id in old_rows if firsts[id].lower().startswith(first_name[0].lower())]
+                if not exact:
+                    if not force_first and len(rows) == 0:
+                        return old_self
+                    elif len(rows) == 1:
+                        return self
+
+            if department_abbrs and len(department_abbrs) > 0:
+                old_self = self
+                self = self.filter(departments__abbr__in = department_abbrs)
+                matches = {}
+                for id in Instructor.departments.through.objects.filter(instructor__in=candidates, department__abbr__in=department_abbrs).values_list('instructor', flat=True):
+                    matches[id] = matches.get(id, 0) + 1
+                rows = [id for id in rows for i in range(matches.get(id, 0))]
+
+                if not exact:
+                    if len(rows) == 0:
+                       return old_self
+                    elif len(rows) == 1:
+                       return self
+
+            if courses is not None:
+                old_self = self
+                self = self.filter(klasses__course__in = courses).distinct()
+                teaching = set(Instructor.klasses.through.objects.filter(instructor__in=candidates, klass__course__in=courses).values_list('instructor', flat=True))
+                rows = [id for id in set(rows) if id in teaching]
+
+                if not exact and len(rows) == 0:
+                   return old_self
+
+            return self
             
         def ft_query_inexact(self, query, course_query=None):
             return self.ft_query(query, course_query=course_query, last_startswith=True)
@@ -538,9 +914,73 @@ class Instructor(models.Model):
                 department_abbrs = None
             
             if dept_abbr and course_number:
-                courses = Course.objects.filter(department_abbr__iexact = dept_abbr, number__icontains = course_number)
+                courses = Course.objects.filter(search_department_abbr = normalize_search(dept_abbr), number__icontains = course_number)
             elif dept_abbr:
-                courses = Course.objects.filter(department_abbr__iexact = dept_abbr)            
+                courses = Course.objects.filter(search_department_abbr = normalize_search(dept_abbr))            
             
+            self = watch(self, 'Instructor.hinted_query', query)
             return self.hinted_query(last_name=last, first_name=first, department_abbrs=department_abbrs, courses=courses, exact=exact, last_startswith=last_startswith)
 
+post_save.connect(invalidate_course_index, sender=Course)
+post_delete.connect(invalidate_course_index, sender=Course)
+
+for model in (Instructor, Department, Course, Klass):
+    post_save.connect(invalidate_instructor_index, sender=model)
+    post_delete.connect(invalidate_instructor_index, sender=model)
+m2m_changed.connect(invalidate_instructor_index, sender=Instructor.klasses.through)
+m2m_changed.connect(invalidate_instructor_index, sender=Instructor.departments.through)
+
+for model in (Course, Department, Klass, Instructor, Subject):
+    post_save.connect(bump_model_version, sender=model)
+    post_delete.connect(bump_model_version, sender=model)
+m2m_changed.connect(bump_instructor_version, sender=Instructor.klasses.through)
+m2m_changed.connect(bump_instructor_version, sender=Instructor.departments.through)
+
+def update_klass_instructor_names(sender, instance, action, reverse, pk_set, **kwargs):
+    """ keeps Klass.cached_instructor_names current as Instructor.klasses changes """
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_klass_ids = list(instance.klasses.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        klass_ids = [instance.pk]
+    elif action == 'post_clear':
+        klass_ids = instance.__dict__.pop('_cleared_klass_ids', [])
+    else:
+        klass_ids = list(pk_set)
+    if klass_ids:
+        Klass.objects.refresh_instructor_names(Klass.objects.filter(pk__in=klass_ids))
+
+def remember_instructor_last(sender, instance, **kwargs):
+    # a deferred last name would be loaded with a query
+    if 'last' in instance.__dict__:
+        instance._original_last = instance.last
+
+def update_instructor_klass_names(sender, instance, created, **kwargs):
+    """ an instructor's last name appears in the cached names of the klasses they teach; refreshed when it changes """
+    original = instance.__dict__.get('_original_last')
+    instance._original_last = instance.last
+    if not created and original != instance.last:
+        Klass.objects.refresh_instructor_names(instance.klasses.all())
+
+def remember_deleted_instructor_klasses(sender, instance, **kwargs):
+    instance._deleted_klass_ids = list(instance.klasses.values_list('id', flat=True))
+
+def remove_deleted_instructor_names(sender, instance, **kwargs):
+    """ drops a deleted instructor's last name from the klasses they taught """
+    klass_ids = instance.__dict__.pop('_deleted_klass_ids', [])
+    if klass_ids:
+        Klass.objects.refresh_instructor_names(Klass.objects.filter(pk__in=klass_ids))
+
+m2m_changed.connect(update_klass_instructor_names, sender=Instructor.klasses.through)
+post_init.connect(remember_instructor_last, sender=Instructor)
+post_save.connect(update_instructor_klass_names, sender=Instructor)
+pre_delete.connect(remember_deleted_instructor_klasses, sender=Instructor)
+post_delete.connect(remove_deleted_instructor_names, sender=Instructor)
+
+for model in (Department, Course, Subject):
+    post_save.connect(invalidate_search_index, sender=model)
+    post_delete.connect(invalidate_search_index, sender=model)
+
+connect_exam_receivers()
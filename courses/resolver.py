@@ -0,0 +1,99 @@
+"""
+Department abbreviation resolver for course queries.
+
+Every known abbreviation is stored in a character trie, normalized by
+uppercasing, dropping spaces, dots and underscores, and spelling '&' as AND.
+A query is walked through the trie once; the longest abbreviation that
+prefixes it gives the department, and the rest gives the course number,
+unless a shorter abbreviation is followed by a space and a course number.
+"""
+import re, threading
+
+from courses.departments_constants import DEPT_ABBRS_INV
+
+__all__ = ["DepartmentResolver", "get_department_resolver"]
+
+END = None
+SKIPPED = " \t._"
+COURSE_PATTERN = re.compile(r'[\s_.]*(?P<course>\w?\d+\w*)')
+TRAILING_PATTERN = re.compile(r'[\s_.]*$')
+
+def normalize(abbr):
+    return "".join([c for c in abbr.upper() if c not in SKIPPED]).replace("&", "AND")
+
+class DepartmentResolver(object):
+    def __init__(self, abbrs_inv):
+        """ abbrs_inv maps every abbreviation to the proper abbreviation, like DEPT_ABBRS_INV """
+        self.root = {}
+        for abbr, proper in abbrs_inv.items():
+            node = self.root
+            for c in normalize(abbr):
+                node = node.setdefault(c, {})
+            node.setdefault(END, proper)
+
+    def matches(self, query):
+        """ Returns (proper abbr, end of the abbreviation in query) for every abbreviation prefixing query, shortest first """
+        node = self.root
+        result = []
+        i = 0
+        for c in query.upper():
+            i += 1
+            if c in SKIPPED:
+                continue
+            if c == "&":
+                node = node.get("A", {}).get("N", {}).get("D")
+            else:
+                node = node.get(c)
+            if node is None:
+                break
+            if END in node:
+                result.append((node[END], i))
+        return result
+
+    def is_coursenumber(self, query, start):
+        """ whether query, from start on, is a course number and nothing else """
+        m = COURSE_PATTERN.match(query, start)
+        return bool(m and TRAILING_PATTERN.match(query, m.end()))
+
+    def match_department(self, query):
+        """
+        Returns (proper abbr, end of the abbreviation in query) for the longest matching abbreviation, or (None, 0).
+        Since spaces are skipped, a longer abbreviation can run on into the course number, as BIO ENG ("BIOE") does
+        for "BIO E10"; an abbreviation followed by a space and the whole of a course number wins over it.
+        """
+        matches = self.matches(query)
+        if not matches:
+            return None, 0
+        for proper, end in reversed(matches[:-1]):
+            if query[end:end + 1].isspace() and self.is_coursenumber(query, end):
+                return proper, end
+        return matches[-1]
+
+    def parse(self, query):
+        """
+        Returns (proper abbr, coursenumber) for a query starting with a known abbreviation, with coursenumber
+        None if the query is just the department. Returns None if the query doesn't look like that.
+        """
+        proper, end = self.match_department(query)
+        if proper is None:
+            return None
+        m = COURSE_PATTERN.match(query, end)
+        if m:
+            return proper, m.group("course").upper().lstrip("0")
+        if TRAILING_PATTERN.match(query, end):
+            return proper, None
+        return None
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+def get_department_resolver():
+    global _resolver
+    if _resolver is None:
+        _resolver_lock.acquire()
+        try:
+            if _resolver is None:
+                _resolver = DepartmentResolver(DEPT_ABBRS_INV)
+        finally:
+            _resolver_lock.release()
+    return _resolver
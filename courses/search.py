@@ -0,0 +1,207 @@
+"""
+Fuzzy name search for departments, courses and subjects.
+
+A search backend answers two questions about a text field: which rows match a
+query (as a Q object, so it composes with other filters), and which rows match
+best (as a list ranked by similarity).  The backend is chosen with the
+COURSES_SEARCH_BACKEND setting, a dotted path to a SearchBackend subclass,
+and defaults to plain icontains matching.
+
+The other backends are opt-in.  PostgresTrigramSearchBackend needs the pg_trgm
+extension and indexes, which the create_trigram_indexes command makes, before
+it is turned on.  TrigramSearchBackend, an in-memory trigram index, is only
+dropped by the signals of the process that changed a row, so it suits a
+single process, or a deployment that restarts its workers after an import.
+"""
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.query import Q
+from django.utils.importlib import import_module
+
+from courses.index import MAX_IN_IDS
+
+__all__ = ["SearchBackend", "ContainsSearchBackend", "TrigramSearchBackend", "PostgresTrigramSearchBackend",
+           "trigrams", "get_search_backend", "invalidate_search_index"]
+
+# pg_trgm's default similarity threshold
+TRIGRAM_THRESHOLD = getattr(settings, 'COURSES_TRIGRAM_THRESHOLD', 0.3)
+
+IN_BULK_CHUNK = 500
+
+def trigrams(text):
+    """ The trigrams of text, computed like pg_trgm: lowercased words padded with two spaces before and one after """
+    result = set()
+    word = []
+    for c in text.lower() + u" ":
+        if c.isalnum():
+            word.append(c)
+        elif word:
+            padded = u"  " + u"".join(word) + u" "
+            for i in range(len(padded) - 2):
+                result.add(padded[i:i + 3])
+            word = []
+    return result
+
+class SearchBackend(object):
+    def match(self, model, field, query):
+        """ Returns a Q object selecting the rows of model whose field matches query """
+        raise NotImplementedError
+
+    def rank(self, queryset, field, query, limit=None, values=None):
+        """ 
+        Returns the objects of queryset whose field matches query, best match first.
+        With values, returns tuples of those fields instead of objects.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, model):
+        """ Called whenever a row of model is saved or deleted """
+        pass
+
+class ContainsSearchBackend(SearchBackend):
+    """ Plain icontains matching, ordered by the model's default ordering """
+    def match(self, model, field, query):
+        return Q(**{'%s__icontains' % field: query})
+
+    def rank(self, queryset, field, query, limit=None, values=None):
+        queryset = queryset.filter(self.match(queryset.model, field, query))
+        if values:
+            queryset = queryset.values_list(*values)
+        if limit is not None:
+            queryset = queryset[:limit]
+        return list(queryset)
+
+class TrigramIndex(object):
+    """ Inverted trigram index over one text field of one model """
+    def __init__(self, rows):
+        self.texts = {}
+        self.sizes = {}
+        self.postings = {}
+        for id, text in rows:
+            grams = trigrams(text)
+            self.texts[id] = text.lower()
+            self.sizes[id] = len(grams)
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(id)
+
+    def search(self, query, threshold=TRIGRAM_THRESHOLD):
+        """ Returns (similarity, id) pairs, substring matches first, then by similarity """
+        query = query.strip().lower()
+        if not query:
+            return []
+        grams = trigrams(query)
+        shared = {}
+        for gram in grams:
+            for id in self.postings.get(gram, ()):
+                shared[id] = shared.get(id, 0) + 1
+        if len(query) < 3:
+            # too short to have a trigram inside a word, so look for substrings everywhere
+            candidates = self.texts.keys()
+        else:
+            candidates = shared.keys()
+        results = []
+        for id in candidates:
+            common = shared.get(id, 0)
+            similarity = float(common) / (len(grams) + self.sizes[id] - common or 1)
+            contains = query in self.texts[id]
+            if contains or similarity >= threshold:
+                results.append((not contains, -similarity, id))
+        results.sort()
+        return [(-similarity, id) for contains, similarity, id in results]
+
+class TrigramSearchBackend(SearchBackend):
+    """ Portable backend keeping a trigram index of each searched field in memory; rebuilt after any change """
+    def __init__(self):
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def get_index(self, model, field):
+        key = (model, field)
+        index = self.indexes.get(key)
+        if index is None:
+            self.lock.acquire()
+            try:
+                index = self.indexes.get(key)
+                if index is None:
+                    index = TrigramIndex(model._base_manager.values_list('pk', field).order_by())
+                    self.indexes[key] = index
+            finally:
+                self.lock.release()
+        return index
+
+    def search_ids(self, model, field, query):
+        return [id for similarity, id in self.get_index(model, field).search(query)]
+
+    def match(self, model, field, query):
+        if len(query.strip()) >= 3:
+            ids = self.search_ids(model, field, query)
+            if len(ids) <= MAX_IN_IDS:
+                return Q(pk__in=ids)
+        # short queries only match substrings anyway, and too many ids would not fit in one IN clause
+        return ContainsSearchBackend().match(model, field, query)
+
+    def rank(self, queryset, field, query, limit=None, values=None):
+        ids = self.search_ids(queryset.model, field, query)
+        ranked = []
+        # queryset may filter some of the ids out, so fetch in chunks until there are enough
+        for start in range(0, len(ids), IN_BULK_CHUNK):
+            chunk = ids[start:start + IN_BULK_CHUNK]
+            if values:
+                objects = dict((row[0], row[1:]) for row in queryset.filter(pk__in=chunk).values_list('pk', *values))
+            else:
+                objects = queryset.in_bulk(chunk)
+            ranked.extend([objects[id] for id in chunk if id in objects])
+            if limit is not None and len(ranked) >= limit:
+                return ranked[:limit]
+        return ranked
+
+    def invalidate(self, model):
+        for key in self.indexes.keys():
+            if key[0] is model:
+                del self.indexes[key]
+
+class PostgresTrigramSearchBackend(SearchBackend):
+    """ Backend using pg_trgm; needs the extension and indexes made by the create_trigram_indexes command """
+    def column(self, model, field):
+        qn = connection.ops.quote_name
+        return '%s.%s' % (qn(model._meta.db_table), qn(model._meta.get_field(field).column))
+
+    def where(self, model, field, query):
+        column = self.column(model, field)
+        return ['(%s %%%% %%s OR UPPER(%s) LIKE UPPER(%%s))' % (column, column)], [query, u'%%%s%%' % query]
+
+    def match(self, model, field, query):
+        where, params = self.where(model, field, query)
+        return Q(pk__in=model._base_manager.extra(where=where, params=params).values('pk'))
+
+    def rank(self, queryset, field, query, limit=None, values=None):
+        where, params = self.where(queryset.model, field, query)
+        queryset = queryset.extra(select={'similarity': 'similarity(%s, %%s)' % self.column(queryset.model, field)},
+                                  select_params=(query,), where=where, params=params).order_by('-similarity')
+        if values:
+            # extra select columns have to be named to stay in a values query
+            queryset = queryset.values_list('similarity', *values)
+        if limit is not None:
+            queryset = queryset[:limit]
+        if values:
+            return [row[1:] for row in queryset]
+        return list(queryset)
+
+_backend = None
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'COURSES_SEARCH_BACKEND', None)
+        if path:
+            module, name = path.rsplit('.', 1)
+            _backend = getattr(import_module(module), name)()
+        else:
+            _backend = ContainsSearchBackend()
+    return _backend
+
+def invalidate_search_index(sender, **kwargs):
+    """ post_save/post_delete receiver """
+    get_search_backend().invalidate(sender)
@@ -0,0 +1,126 @@
+"""
+Slow-query capture for the search querysets.
+
+Course.QuerySet.ft_query, Department.QuerySet.ft_query_all and
+Instructor.QuerySet.hinted_query mark the querysets they return with watch().
+The mark survives filtering, slicing, values_list and count, and whenever a
+marked queryset runs a statement slower than COURSES_SLOW_QUERY_MS
+milliseconds, the SQL, its parameters, the user's query string and the
+database's EXPLAIN output are logged to the 'courses.slowlog' logger and kept
+in a ring buffer of the last COURSES_SLOW_QUERY_BUFFER entries, which the
+instrument_stats view serves along with the histograms of courses.instrument.
+
+Capture is off unless COURSES_SLOW_QUERY_MS is set; 0 captures every query.
+"""
+from collections import deque
+import datetime
+import logging
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+from django.db.models.sql import Query
+
+__all__ = ["explain_sql", "watch", "get_slow_queries", "reset_slow_queries", "slow_query_threshold"]
+
+logger = logging.getLogger('courses.slowlog')
+
+BUFFER_SIZE = getattr(settings, 'COURSES_SLOW_QUERY_BUFFER', 100)
+
+_entries = deque(maxlen=BUFFER_SIZE)
+_entries_lock = threading.Lock()
+
+def slow_query_threshold():
+    """ COURSES_SLOW_QUERY_MS in seconds, or None if capture is off """
+    threshold = getattr(settings, 'COURSES_SLOW_QUERY_MS', None)
+    if threshold is None:
+        return None
+    return threshold / 1e3
+
+def explain_sql(sql, params, using='default'):
+    """ Returns the database's query plan for sql as a list of rows """
+    connection = connections[using]
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    else:
+        cursor.execute("EXPLAIN " + sql, params)
+    return cursor.fetchall()
+
+def capture(label, user_query, sql, params, seconds, using):
+    try:
+        plan = [list(row) for row in explain_sql(sql, params, using)]
+    except DatabaseError, e:
+        plan = "EXPLAIN failed: %s" % e
+    entry = {
+        "label": label,
+        "query": user_query,
+        "sql": sql,
+        "params": [unicode(param) for param in params],
+        "ms": seconds * 1e3,
+        "plan": plan,
+        "time": datetime.datetime.now().isoformat(),
+    }
+    _entries_lock.acquire()
+    try:
+        _entries.append(entry)
+    finally:
+        _entries_lock.release()
+    logger.warning("slow query in %s (%.1f ms) for %r: %s; params %r; plan %r",
+                   label, entry["ms"], user_query, sql, params, plan)
+
+def get_slow_queries():
+    """ The captured slow queries, oldest first """
+    _entries_lock.acquire()
+    try:
+        return list(_entries)
+    finally:
+        _entries_lock.release()
+
+def reset_slow_queries():
+    _entries_lock.acquire()
+    try:
+        _entries.clear()
+    finally:
+        _entries_lock.release()
+
+class WatchedQuery(Query):
+    """ A Query whose statements are timed; clones, and so every queryset derived from it, keep the watch """
+    watch = None
+
+    def clone(self, klass=None, memo=None, **kwargs):
+        obj = super(WatchedQuery, self).clone(klass, memo, **kwargs)
+        obj.watch = self.watch
+        return obj
+
+    def get_compiler(self, using=None, connection=None):
+        compiler = super(WatchedQuery, self).get_compiler(using, connection)
+        threshold = slow_query_threshold()
+        if threshold is None:
+            return compiler
+        label, user_query = self.watch
+        execute_sql = compiler.execute_sql
+        def timed_execute_sql(*args, **kwargs):
+            start = default_timer()
+            result = execute_sql(*args, **kwargs)
+            seconds = default_timer() - start
+            if seconds >= threshold:
+                sql, params = compiler.as_sql()
+                capture(label, user_query, sql, params, seconds, compiler.using)
+            return result
+        compiler.execute_sql = timed_execute_sql
+        return compiler
+
+def watch(queryset, label, user_query):
+    """
+    Marks queryset so its slow statements are captured under label, with the user's query string. A queryset that
+    is already marked keeps its mark, so the outermost search names the query. Returns queryset unchanged when
+    capture is off.
+    """
+    if slow_query_threshold() is None or isinstance(queryset.query, WatchedQuery):
+        return queryset
+    queryset = queryset._clone()
+    queryset.query = queryset.query.clone(klass=WatchedQuery)
+    queryset.query.watch = (label, user_query)
+    return queryset
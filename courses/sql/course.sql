@@ -0,0 +1,3 @@
+CREATE INDEX courses_course_search_coursenumber ON courses_course (search_department_abbr, search_coursenumber);
+CREATE INDEX courses_course_search_number ON courses_course (search_department_abbr, search_number);
+CREATE INDEX courses_course_keyset ON courses_course (department_abbr, integer_number, coursenumber, id);
@@ -0,0 +1,2 @@
+CREATE INDEX courses_klass_course_semester_section ON courses_klass (course_id, semester, section);
+CREATE INDEX courses_klass_semester ON courses_klass (semester);
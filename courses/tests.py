@@ -1,6 +1,710 @@
-from django.test import TestCase
+import json
+
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.forms import ValidationError
+from django.db import models
+from django.core.cache import cache
+
+from courses.models import Department, Course, Klass, Instructor
+from courses.forms.fields import ManyCoursesField
+from courses.exams import update_leaderboard, top_by_published_exams
+from courses.instructor_index import InstructorIndex
 
 class CoursesTests(TestCase):
     def test_environment(self):
         """Just make sure everything is set up correctly."""
         self.assert_(True)
+
+def make_catalog():
+    """ A small catalog with overlapping instructor names, for the query tests """
+    cs = Department.objects.create(name="Computer Science", abbr="COMPSCI")
+    ee = Department.objects.create(name="Electrical Engineering", abbr="EL ENG")
+    math = Department.objects.create(name="Mathematics", abbr="MATH")
+    courses = {}
+    for dept, coursenumber, name in ((cs, "61A", "Structure and Interpretation of Computer Programs"),
+                                     (cs, "61B", "Data Structures"),
+                                     (ee, "20N", "Structure and Interpretation of Systems and Signals"),
+                                     (math, "1A", "Calculus")):
+        courses[(dept.abbr, coursenumber)] = Course.objects.create(department=dept, coursenumber=coursenumber, name=name, description="")
+    instructors = []
+    for home, others, first, last, taught in ((cs, (), "Brian", "Harvey", (("COMPSCI", "61A"),)),
+                                              (cs, (ee,), "Paul", "Hilfinger", (("COMPSCI", "61B"),)),
+                                              (ee, (cs,), "Paul", "Hill", (("EL ENG", "20N"),)),
+                                              (math, (), "Pat", "Hill", (("MATH", "1A"),)),
+                                              (math, (cs, ee), "Hal", "Hill", ()),
+                                              (cs, (), "Dan", "Garcia", (("COMPSCI", "61A"), ("COMPSCI", "61B")))):
+        instructor = Instructor.objects.create(home_department=home, first=first, middle="", last=last, email="")
+        for dept in others:
+            instructor.departments.add(dept)
+        for key in taught:
+            klass = Klass.objects.create(course=courses[key], semester="fa09", section="1", section_type="LEC", section_note="", website="", newsgroup="")
+            instructor.klasses.add(klass)
+        instructors.append(instructor)
+    return courses, instructors
+
+class CatalogTestCase(TestCase):
+    """ A TestCase with the make_catalog catalog loaded, as self.courses and self.instructors """
+    def setUp(self):
+        self.courses, self.instructors = make_catalog()
+
+class InstructorHintedQueryTests(CatalogTestCase):
+    def assertSamePaths(self, **kwargs):
+        counting = Instructor.objects.hinted_query(prefetch=False, **kwargs)
+        prefetched = Instructor.objects.hinted_query(prefetch=True, **kwargs)
+        self.assertEqual(sorted(counting.values_list('id', flat=True)), sorted(prefetched.values_list('id', flat=True)), kwargs)
+
+    def test_prefetched_matches_counting(self):
+        cs_courses = Course.objects.filter(department_abbr="COMPSCI")
+        no_courses = Course.objects.filter(department_abbr="NOPE")
+        for last_name, last_startswith in (("Hill", False), ("Hil", True), ("H", True), ("Harvey", False), ("Nobody", False)):
+            for first_name in (None, "Paul", "Pete", "Hal", "X"):
+                for department_abbrs in (None, ("COMPSCI",), ("COMPSCI", "EL ENG"), ("MATH",), ("STAT",)):
+                    for courses in (None, cs_courses, no_courses):
+                        for exact in (False, True):
+                            for force_first in (False, True):
+                                self.assertSamePaths(last_name=last_name, last_startswith=last_startswith, first_name=first_name,
+                                                     department_abbrs=department_abbrs, courses=courses, exact=exact, force_first=force_first)
+
+    def test_prefetched_query_counts(self):
+        ee_courses = Course.objects.filter(department_abbr="EL ENG")
+        # the candidates, one query per hint step reached, and the returned queryset
+        for queries, kwargs in ((2, dict(last_name="Harvey")),
+                                (2, dict(last_name="Hill", first_name="Pat")),
+                                (3, dict(last_name="Hill", department_abbrs=("MATH",))),
+                                (4, dict(last_name="Hill", department_abbrs=("EL ENG",), courses=ee_courses))):
+            instructors = []
+            self.assertNumQueries(queries, lambda: instructors.extend(Instructor.objects.hinted_query(prefetch=True, **kwargs)))
+            self.assertTrue(instructors, kwargs)
+
+    def test_index_matches_prefetched(self):
+        index = InstructorIndex.build()
+        cs_ids = set(Course.objects.filter(department_abbr="COMPSCI").values_list('id', flat=True))
+        for last_name, last_startswith in (("Hill", False), ("Hil", True), ("H", True), ("Harvey", False), ("Nobody", False)):
+            for first_name in (None, "Paul", "Pete", "Hal", "X"):
+                for department_abbrs in (None, ("COMPSCI",), ("COMPSCI", "EL ENG"), ("MATH",), ("STAT",)):
+                    for courses in (None, cs_ids):
+                        for force_first in (False, True):
+                            kwargs = dict(last_name=last_name, last_startswith=last_startswith, first_name=first_name,
+                                          department_abbrs=department_abbrs, force_first=force_first)
+                            prefetched = Instructor.objects.hinted_query(prefetch=True, courses=courses and Course.objects.filter(pk__in=courses), **kwargs)
+                            ids = index.hinted(course_filter=courses and courses.__contains__, **kwargs)
+                            self.assertEqual(sorted(set(prefetched.values_list('id', flat=True))), sorted(ids), kwargs)
+
+        for query, course_query in (("Hill", "EE 20N"), ("Hil", None), ("Hill, Pat", None), ("Hill", "STAT 2")):
+            self.assertEqual(sorted(Instructor.objects.get_query_set().ft_query_inexact(query, course_query).values_list('id', flat=True)),
+                             sorted(index.ft_query(query, course_query=course_query, last_startswith=True)), query)
+        # an exact course hint matching no course matches no instructor
+        self.assertEqual(list(Instructor.objects.ft_query("Hill", course_query="STAT 2", exact=True)), [])
+        self.assertEqual(index.ft_query("Hill", course_query="STAT 2", exact=True), [])
+
+    def test_ft_query(self):
+        self.assertEqual([i.last for i in Instructor.objects.ft_query("Harvey, Brian")], ["Harvey"])
+        self.assertEqual([i.first for i in Instructor.objects.ft_query("Hill", course_query="EE 20N")], ["Paul"])
+
+class CachedLookupTests(CatalogTestCase):
+    def setUp(self):
+        cache.clear()
+        super(CachedLookupTests, self).setUp()
+
+    def test_course_ft_query(self):
+        self.assertEqual(len(Course.objects.cached_ft_query("CS 61", 10)), 2)
+        self.assertNumQueries(0, lambda: Course.objects.cached_ft_query("CS 61", 10))
+        # the post_save receiver bumps the course version
+        Course.objects.create(department=Department.objects.get(abbr="COMPSCI"), coursenumber="61C", name="Machine Structures", description="")
+        self.assertEqual(len(Course.objects.cached_ft_query("CS 61", 10)), 3)
+
+    def test_department_autocomplete(self):
+        self.assertEqual([name for name, id in Department.objects.cached_autocomplete("MATH")], ["Mathematics"])
+        self.assertNumQueries(0, lambda: Department.objects.cached_autocomplete("MATH"))
+        math = Department.objects.get(abbr="MATH")
+        math.name = "Applied Mathematics"
+        math.save()
+        self.assertEqual([name for name, id in Department.objects.cached_autocomplete("MATH")], ["Applied Mathematics"])
+
+    def test_instructor_autocomplete(self):
+        firsts = lambda: sorted([row[1] for row in Instructor.objects.cached_autocomplete("Hill", "MATH 1A", 10)])
+        self.assertEqual(firsts(), ["Pat"])
+        self.assertNumQueries(0, firsts)
+        # the m2m_changed receiver bumps the instructor version
+        hal = [i for i in self.instructors if i.first == "Hal"][0]
+        hal.klasses.add(Klass.objects.get(course=self.courses[("MATH", "1A")]))
+        self.assertEqual(firsts(), ["Hal", "Pat"])
+
+class VersionedValueTests(TestCase):
+    def test_rebuilt_on_bump_or_invalidate(self):
+        from courses.cache import VersionedValue, bump_version
+        builds = []
+        value = VersionedValue(lambda: builds.append(1) or len(builds), ('course',))
+        self.assertEqual((value.get(), value.get()), (1, 1))
+        bump_version('course')
+        self.assertEqual(value.get(), 2)
+        value.invalidate()
+        self.assertEqual(value.get(), 3)
+
+@override_settings(COURSES_SLOW_QUERY_MS=0)
+class SlowQueryLogTests(CatalogTestCase):
+    def setUp(self):
+        from courses import slowlog
+        super(SlowQueryLogTests, self).setUp()
+        slowlog.reset_slow_queries()
+
+    def tearDown(self):
+        from courses import slowlog
+        slowlog.reset_slow_queries()
+
+    def test_capture(self):
+        from courses import slowlog
+        list(Instructor.objects.get_query_set().ft_query("Hill", course_query="EE 20N"))
+        list(Course.objects.ft_query("CS 61A").values_list('id', flat=True)[:5])
+        entries = slowlog.get_slow_queries()
+        self.assertEqual(set((e["label"], e["query"]) for e in entries),
+                         set([("Instructor.hinted_query", "Hill"), ("Course.ft_query", "CS 61A")]))
+        self.assert_(all(e["plan"] for e in entries))
+
+    @override_settings(COURSES_SLOW_QUERY_MS=None)
+    def test_disabled(self):
+        from courses import slowlog
+        list(Course.objects.ft_query("CS 61A"))
+        self.assertEqual(slowlog.get_slow_queries(), [])
+
+@override_settings(COURSES_SEARCH_INDEX=True)
+class CourseIndexTests(CatalogTestCase):
+    def tearDown(self):
+        from courses.index import invalidate_course_index
+        invalidate_course_index()
+
+    def test_rebuilt_when_another_process_changes_courses(self):
+        from courses.index import get_course_index
+        from courses.cache import bump_version
+        index = get_course_index()
+        self.assertTrue(get_course_index() is index)
+        # a save in another process: no signal here, only the shared version changes
+        course = Course(department=Department.objects.get(abbr="COMPSCI"), coursenumber="61C", name="Machine Structures", description="")
+        course.fill_derived_fields()
+        Course.objects.bulk_create([course])
+        self.assertEqual(len(Course.objects.ft_query_page("CS 61", 10)), 2)
+        bump_version('course')
+        self.assertFalse(get_course_index() is index)
+        self.assertEqual(len(Course.objects.ft_query_page("CS 61", 10)), 3)
+
+@override_settings(COURSES_INSTRUCTOR_INDEX=True)
+class InstructorIndexTests(CatalogTestCase):
+    def tearDown(self):
+        from courses.instructor_index import invalidate_instructor_index
+        invalidate_instructor_index()
+
+    def test_rebuilt_when_another_process_changes_instructors(self):
+        from courses.instructor_index import get_instructor_index
+        from courses.cache import bump_version
+        index = get_instructor_index()
+        self.assertTrue(get_instructor_index() is index)
+        # a save in another process: no signal here, only the shared version changes
+        Instructor.objects.bulk_create([Instructor(home_department=Department.objects.get(abbr="MATH"), home_department_abbr="MATH",
+                                                   first="Pete", middle="", last="Hill", email="")])
+        self.assertEqual(len(index.candidates("Hill")), 3)
+        bump_version('instructor')
+        self.assertFalse(get_instructor_index() is index)
+        self.assertEqual(len(get_instructor_index().candidates("Hill")), 4)
+
+@override_settings(COURSES_SEARCH_BACKEND='courses.search.TrigramSearchBackend')
+class FuzzySearchTests(CatalogTestCase):
+    def setUp(self):
+        from courses import search
+        super(FuzzySearchTests, self).setUp()
+        Department.objects.create(name="Physics", abbr="PHYSICS")
+        # chosen again from the setting
+        search._backend = None
+
+    def tearDown(self):
+        from courses import search
+        search._backend = None
+
+    def test_typo(self):
+        self.assertEqual([d.name for d in Department.objects.rank_name("Phsyics")], ["Physics"])
+        self.assertEqual([d.name for d in Department.objects.ft_query_all("Phsyics")], ["Physics"])
+
+    def test_substring_first(self):
+        self.assertEqual(Department.objects.rank_name("eng")[0].name, "Electrical Engineering")
+        self.assertEqual(Course.objects.rank_name("Structure")[0].coursenumber, "61B")
+        self.assertEqual(len(Course.objects.rank_name("Structure", limit=2)), 2)
+
+    def test_match_falls_back_to_contains(self):
+        from courses import search
+        contains = lambda q: sorted(Course.objects.filter(name__icontains=q).values_list('id', flat=True))
+        fuzzy = lambda q: sorted(Course.objects.ft_query_name_fuzzy(q).values_list('id', flat=True))
+        self.assertEqual(fuzzy("a"), contains("a"))
+        max_in_ids = search.MAX_IN_IDS
+        search.MAX_IN_IDS = 1
+        try:
+            self.assertEqual(fuzzy("Structure"), contains("Structure"))
+        finally:
+            search.MAX_IN_IDS = max_in_ids
+
+    @override_settings(COURSES_SEARCH_BACKEND=None)
+    def test_default_backend(self):
+        from courses import search
+        # PostgreSQL too, since pg_trgm may not be installed
+        search._backend = None
+        self.assertTrue(isinstance(search.get_search_backend(), search.ContainsSearchBackend))
+
+class ParseQueryTests(TestCase):
+    # where the resolver knows better than the regexes: abbreviations written without their space or with '&'
+    RESOLVER_DIFFERS = {
+        "eleng 20": ("EL ENG", "20"),
+        "Envir Econ & Policy C1": ("ENVECON", "C1"),
+    }
+
+    def test_resolver_matches_regex(self):
+        from courses.benchmark import PARSE_QUERY_CORPUS
+        for query in PARSE_QUERY_CORPUS + ("BIO E10", "BIOE 10", "ME C85", "CS C149"):
+            expected = self.RESOLVER_DIFFERS.get(query, Course.QuerySet.parse_query_regex(query))
+            self.assertEqual(Course.QuerySet.parse_query.uncached(query), expected, query)
+
+    def test_space_ends_abbreviation_before_coursenumber(self):
+        self.assertEqual(Course.QuerySet.parse_query.uncached("BIO E10"), ("BIOLOGY", "E10"))
+        self.assertEqual(Course.QuerySet.parse_query.uncached("BIOE 10"), ("BIO ENG", "10"))
+
+class MemoizeTests(TestCase):
+    def test_eviction_at_bound(self):
+        from courses.memoize import LRUCache
+        lru = LRUCache(2)
+        computed = []
+        def get(key):
+            return lru.get_or_compute(key, lambda: computed.append(key) or key.upper())
+        for key in ("a", "b", "a", "c"):
+            get(key)
+        # c evicted b, the least recently used
+        self.assertEqual(lru.info(), {"hits": 1, "misses": 3, "size": 2, "maxsize": 2})
+        self.assertEqual((get("a"), get("b")), ("A", "B"))
+        self.assertEqual(computed, ["a", "b", "c", "b"])
+
+    def test_benchmark_stats(self):
+        from courses.benchmark import bench_parse_query, PARSE_QUERY_CORPUS
+        result = bench_parse_query(repeat=2)
+        misses = len(set(PARSE_QUERY_CORPUS))
+        self.assertEqual((result["memoized_hits"], result["memoized_misses"]), (2 * len(PARSE_QUERY_CORPUS) - misses, misses))
+
+class NormalizeSearchColumnsTests(CatalogTestCase):
+    def test_backfill(self):
+        from django.core.management import call_command
+        Course.objects.update(search_department_abbr="", search_coursenumber="", search_number="")
+        Department.all.update(search_name="")
+        # one SELECT per column, and one UPDATE per distinct value: 3 names, 3 abbrs, 4 course numbers, 4 numbers
+        self.assertNumQueries(4 + 14, call_command, 'normalize_search_columns', verbosity=0)
+        self.assertEqual(Course.objects.get(search_department_abbr="EL ENG", search_coursenumber="20N").search_number, "20N")
+        self.assertEqual(Department.all.get(search_name="COMPUTER SCIENCE").abbr, "COMPSCI")
+
+class CatalogImportTests(TestCase):
+    RECORDS = '''{"department": "CS", "department_name": "Computer Science", "coursenumber": "61a", "name": "SICP", "semester": "fa09", "section": "1", "instructors": [{"last": "Harvey", "first": "Brian"}]}
+{"department": "COMPSCI", "coursenumber": "61B", "name": "Data Structures", "semester": "fa09", "section": "1", "instructors": [{"last": "Hilfinger", "first": "Paul"}, {"last": "Harvey", "first": "Brian"}]}
+'''
+
+    def run_import(self):
+        from StringIO import StringIO
+        from courses.importer import import_catalog
+        return import_catalog(StringIO(self.RECORDS), format='json')
+
+    def test_import(self):
+        stats = self.run_import()
+        self.assertEqual((stats['courses_created'], stats['klasses_created'], stats['instructors_created']), (2, 2, 2))
+        course = Course.objects.query_exact("CS", "61A").get()
+        self.assertEqual((course.prefix, course.number, course.integer_number), ("", "61A", 61))
+        harvey = Instructor.objects.get(last="Harvey")
+        self.assertEqual(harvey.home_department_abbr, "CS")
+        self.assertEqual(list(harvey.departments.values_list('abbr', flat=True)), ["COMPSCI"])
+        self.assertEqual(harvey.klasses.count(), 2)
+        self.assertEqual(Klass.objects.get(course__coursenumber="61B").instructor_names, "Hilfinger; Harvey")
+
+    def test_reimport_upserts(self):
+        self.run_import()
+        stats = self.run_import()
+        self.assertEqual((stats['courses_created'], stats['klasses_created'], stats['instructors_created'], stats['instructor_links_created']), (0, 0, 0, 0))
+        self.assertEqual(Course.objects.count(), 2)
+        self.assertEqual(Instructor.objects.count(), 2)
+
+    def test_chunked_lookups(self):
+        from courses import importer
+        max_in_ids = importer.MAX_IN_IDS
+        importer.MAX_IN_IDS = 1
+        try:
+            self.run_import()
+            stats = self.run_import()
+        finally:
+            importer.MAX_IN_IDS = max_in_ids
+        self.assertEqual(stats['instructor_links_created'], 0)
+        self.assertEqual(Instructor.objects.get(last="Harvey").klasses.count(), 2)
+        self.assertEqual(Klass.objects.get(course__coursenumber="61B").instructor_names, "Hilfinger; Harvey")
+
+class InstructorSaveTests(TestCase):
+    def setUp(self):
+        self.cs = Department.objects.create(name="Computer Science", abbr="COMPSCI")
+
+    def test_save_queries(self):
+        instructor = Instructor(home_department=self.cs, first="Brian", middle="", last="Harvey", email="")
+        # insert, membership check, membership insert
+        self.assertNumQueries(3, instructor.save)
+        self.assertEqual(list(instructor.departments.all()), [self.cs])
+        instructor.save()
+        self.assertEqual(instructor.departments.count(), 1)
+
+    def test_update_queries(self):
+        instructor = Instructor.objects.create(home_department=self.cs, first="Brian", middle="", last="Harvey", email="")
+        course = Course.objects.create(department=self.cs, coursenumber="61A", name="SICP", description="")
+        for section in range(5):
+            instructor.klasses.add(Klass.objects.create(course=course, semester="fa09", section=str(section), section_type="LEC",
+                                                        section_note="", website="", newsgroup=""))
+        instructor.first = "B."
+        # existence check, update, membership check; the klasses are left alone while the last name stays
+        self.assertNumQueries(3, instructor.save)
+
+    def test_save_many(self):
+        instructors = [Instructor(home_department_id=self.cs.pk, first=first, middle="", last=last, email="")
+                       for first, last in (("Brian", "Harvey"), ("Dan", "Garcia"))]
+        Instructor.objects.save_many(instructors)
+        self.assertEqual([i.home_department_abbr for i in instructors], ["CS", "CS"])
+        self.assertEqual(self.cs.instructors.count(), 2)
+
+class KlassDisplayTests(CatalogTestCase):
+    def render(self):
+        return [(str(klass), klass.instructor_names) for klass in Klass.objects.for_display()]
+
+    def test_constant_queries(self):
+        # klasses with their courses, then all their instructors
+        self.assertNumQueries(2, self.render)
+        harvey = self.instructors[0]
+        for i in range(10):
+            klass = Klass.objects.create(course=self.courses[("COMPSCI", "61A")], semester="fa09", section=str(i + 2),
+                                         section_type="LEC", section_note="", website="", newsgroup="")
+            harvey.klasses.add(klass)
+        self.assertNumQueries(2, self.render)
+        self.assertEqual(len(self.render()), 16)
+
+    def test_admin_queryset(self):
+        from django.contrib import admin
+        from django.test.client import RequestFactory
+        from courses.admin import KlassAdmin
+        queryset = KlassAdmin(Klass, admin.site).queryset(RequestFactory().get('/'))
+        render = lambda: [(str(klass), klass.instructor_names) for klass in queryset.all()]
+        self.assertNumQueries(2, render)
+        self.assertEqual(len(render()), 6)
+
+    def test_names_follow_instructor_changes(self):
+        garcia = self.instructors[-1]
+        klass_ids = list(garcia.klasses.values_list('id', flat=True))
+        names = lambda: sorted(set(Klass.objects.filter(pk__in=klass_ids).values_list('cached_instructor_names', flat=True)))
+        self.assertEqual(names(), ["Garcia"])
+        garcia.first = "Daniel"
+        # an update that keeps the last name leaves the klasses alone
+        self.assertNumQueries(3, garcia.save)
+        garcia.last = "Garcia-Lopez"
+        garcia.save()
+        self.assertEqual(names(), ["Garcia-Lopez"])
+        Instructor.objects.get(pk=garcia.pk).delete(force_delete=True)
+        self.assertEqual(names(), [""])
+
+class ManyFieldTests(CatalogTestCase):
+    def test_one_query_in_submitted_order(self):
+        field = ManyCoursesField()
+        wanted = [self.courses[("MATH", "1A")], self.courses[("COMPSCI", "61A")], self.courses[("EL ENG", "20N")]]
+        value = [(str(course.id), "") for course in wanted]
+        self.assertNumQueries(1, field.clean, value)
+        self.assertEqual(field.clean(value), wanted)
+
+    def test_reports_every_invalid_id(self):
+        field = ManyCoursesField()
+        value = [(str(self.courses[("MATH", "1A")].id), ""), ("x", ""), ("999999", "")]
+        try:
+            field.clean(value)
+        except ValidationError, e:
+            self.assertTrue("x" in e.messages[0] and "999999" in e.messages[0], e.messages)
+        else:
+            self.fail("no ValidationError")
+
+class LeaderboardTests(TestCase):
+    rows = [(5, "A", 1), (3, "B", 2), (3, "C", 3)]
+
+    def test_moves_row(self):
+        rows, complete = update_leaderboard((self.rows, False), 3, 3, None, size=3)
+        self.assertEqual(rows, [(6, "C", 3), (5, "A", 1), (3, "B", 2)])
+
+    def test_drops_row_below_unknown(self):
+        # something outside may have 3 exams now
+        rows, complete = update_leaderboard((self.rows, False), 2, -1, None, size=3)
+        self.assertEqual(rows, [(5, "A", 1), (3, "C", 3)])
+        self.assertFalse(complete)
+
+    def test_keeps_row_of_complete(self):
+        rows, complete = update_leaderboard((self.rows, True), 2, -1, None, size=3)
+        self.assertEqual(rows, [(5, "A", 1), (3, "C", 3), (2, "B", 2)])
+        self.assertTrue(complete)
+
+    def test_new_row(self):
+        fetch = lambda id: (4, "D", id)
+        rows, complete = update_leaderboard((self.rows, True), 4, 1, fetch, size=3)
+        self.assertEqual(rows, [(5, "A", 1), (4, "D", 4), (3, "B", 2)])
+        self.assertFalse(complete)
+        self.assertEqual(update_leaderboard((self.rows, False), 4, -1, fetch, size=3), None)
+
+class ReceiverTestExam(models.Model):
+    """ Stands in for the exam model; never saved, the receivers are called directly """
+    department = models.ForeignKey(Department, null=True)
+    course = models.ForeignKey(Course, null=True)
+    publishable = models.BooleanField()
+
+    class Meta:
+        app_label = 'courses'
+        managed = False
+
+class ExamReceiverTests(CatalogTestCase):
+    def setUp(self):
+        from courses.exams import ExamReceivers, _leaderboard_key
+        super(ExamReceiverTests, self).setUp()
+        self.cs, self.math = Department.objects.get(abbr="COMPSCI"), Department.objects.get(abbr="MATH")
+        Department.objects.filter(pk=self.cs.pk).update(published_exams=2)
+        Department.objects.filter(pk=self.math.pk).update(published_exams=1)
+        self.key = _leaderboard_key(Department)
+        cache.set(self.key, ([(2, self.cs.name, self.cs.pk), (1, self.math.name, self.math.pk)], True))
+        self.receivers = ExamReceivers(ReceiverTestExam)
+
+    def tearDown(self):
+        cache.delete(self.key)
+
+    def counts(self):
+        return [(d.abbr, d.exam_count) for d in top_by_published_exams(Department.objects.all(), 2)]
+
+    def test_publish_move_unpublish_delete(self):
+        exam = ReceiverTestExam(department=self.math, publishable=True)
+        self.receivers.post_save(ReceiverTestExam, exam, created=True)
+        self.assertEqual(self.counts(), [("COMPSCI", 2), ("MATH", 2)])
+        exam.department = self.cs
+        self.receivers.post_save(ReceiverTestExam, exam, created=False)
+        self.assertEqual(self.counts(), [("COMPSCI", 3), ("MATH", 1)])
+        self.assertEqual(Department.objects.get(pk=self.cs.pk).published_exams, 3)
+        exam.publishable = False
+        self.receivers.post_save(ReceiverTestExam, exam, created=False)
+        self.receivers.post_delete(ReceiverTestExam, exam)
+        self.assertEqual(self.counts(), [("COMPSCI", 2), ("MATH", 1)])
+        self.assertEqual(Department.objects.get(pk=self.cs.pk).published_exams, 2)
+
+    def test_drops_leaderboard_while_locked(self):
+        cache.add(self.key + ':lock', 1)
+        try:
+            self.receivers.post_save(ReceiverTestExam, ReceiverTestExam(department=self.math, publishable=True), created=True)
+        finally:
+            cache.delete(self.key + ':lock')
+        self.assertEqual(cache.get(self.key), None)
+        self.assertEqual(Department.objects.get(pk=self.math.pk).published_exams, 2)
+
+class ExamCounterTests(CatalogTestCase):
+    def test_annotate_from_counters(self):
+        Department.objects.filter(abbr="MATH").update(published_exams=1)
+        Department.objects.filter(abbr="COMPSCI").update(published_exams=3)
+        departments = Department.objects.annotate_exam_count(counters=True).order_by("-exam_count")
+        self.assertEqual([(d.abbr, d.exam_count) for d in departments], [("COMPSCI", 3), ("MATH", 1)])
+        self.assertEqual(Department.objects.get(abbr="COMPSCI").published_exam_count(), 3)
+
+class CatalogBundleTests(CatalogTestCase):
+    urls = 'courses.urls'
+
+    def test_bundle(self):
+        response = self.client.get('/catalog_bundle/')
+        self.assertEqual(response.status_code, 200)
+        bundle = json.loads(response.content)
+        self.assertEqual(bundle["departments"][0][1:3], ["Computer Science", "CS"])
+        self.assertTrue("COMPSCI" in bundle["departments"][0][3])
+        self.assertEqual(len(bundle["courses"]), 4)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/catalog_bundle/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        response = self.client.get('/catalog_bundle/', {'v': bundle["version"]})
+        self.assertEqual(response['Cache-Control'], 'public, max-age=%d' % (60 * 60 * 24 * 365))
+
+        Course.objects.create(department=Department.objects.get(abbr="MATH"), coursenumber="1B", name="Calculus", description="")
+        response = self.client.get('/catalog_bundle/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)["courses"]), 5)
+
+class ConditionalGetTests(CatalogTestCase):
+    urls = 'courses.urls'
+
+    def test_not_modified_until_catalog_changes(self):
+        response = self.client.get('/course_autocomplete/', {'q': 'CS 61'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('max-age=' in response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get('/course_autocomplete/', {'q': 'CS 61'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.client.get('/course_autocomplete/', {'q': 'CS 6'})['ETag'], etag)
+
+        Course.objects.create(department=Department.objects.get(abbr="COMPSCI"), coursenumber="61C", name="Machine Structures", description="")
+        response = self.client.get('/course_autocomplete/', {'q': 'CS 61'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("61C" in response.content)
+
+class CoursenumberAutocompleteTests(CatalogTestCase):
+    urls = 'courses.urls'
+
+    def test_limit(self):
+        get = lambda limit: self.client.get('/coursenumber_autocomplete/', {'q': '6', 'department_query': 'CS', 'limit': limit})
+        self.assertEqual(get(1).content.count('\n'), 1)
+        self.assertEqual(get(0).status_code, 400)
+        self.assertEqual(get(-1).status_code, 400)
+
+class KeysetPaginationTests(CatalogTestCase):
+    urls = 'courses.urls'
+
+    def setUp(self):
+        super(KeysetPaginationTests, self).setUp()
+        cs = Department.objects.get(abbr="COMPSCI")
+        for coursenumber in ("C149", "W61A", "170", "61BL", "1"):
+            Course.objects.create(department=cs, coursenumber=coursenumber, name=coursenumber, description="")
+
+    def all_pages(self, query, limit, **kwargs):
+        ids, cursor = [], None
+        while True:
+            rows, cursor = Course.objects.ft_query_after(query, limit, cursor, fields=('id',), **kwargs)
+            ids.extend([row[0] for row in rows])
+            if cursor is None:
+                return ids
+
+    def expected(self):
+        from courses.keyset import KEYSET_FIELDS
+        return list(Course.objects.ft_query("CS").order_by(*KEYSET_FIELDS).values_list('id', flat=True))
+
+    def test_pages_match_ordering(self):
+        expected = self.expected()
+        self.assertEqual(len(expected), 7)
+        for limit in (1, 2, 3, 7, 8):
+            self.assertEqual(self.all_pages("CS", limit), expected, limit)
+
+    @override_settings(COURSES_SEARCH_INDEX=True)
+    def test_pages_match_ordering_with_index(self):
+        from courses.index import invalidate_course_index
+        expected = self.expected()
+        try:
+            for limit in (1, 3, 7):
+                self.assertEqual(self.all_pages("CS", limit), expected, limit)
+        finally:
+            invalidate_course_index()
+
+    def test_cursor_survives_changes(self):
+        first, cursor = Course.objects.ft_query_after("CS", 3)
+        Course.objects.create(department=Department.objects.get(abbr="COMPSCI"), coursenumber="0", name="Zero", description="")
+        rest, cursor = Course.objects.ft_query_after("CS", 10, cursor)
+        self.assertEqual(len(first) + len(rest), 7)
+        self.assertFalse(set(first) & set(rest))
+        self.assertRaises(ValueError, Course.objects.ft_query_after, "CS", 3, cursor="forged")
+
+    def test_views(self):
+        response = self.client.get('/course_autocomplete/', {'q': 'CS', 'limit': 4, 'cursor': ''})
+        self.assertEqual(len(response.content.splitlines()), 4)
+        response = self.client.get('/course_autocomplete/', {'q': 'CS', 'limit': 4, 'cursor': response['X-Next-Cursor']})
+        self.assertEqual(len(response.content.splitlines()), 3)
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+        self.assertEqual(self.client.get('/course_autocomplete/', {'q': 'CS', 'cursor': 'forged'}).status_code, 400)
+
+        response = self.client.get('/find_course/', {'q': 'CS', 'limit': 5, 'cursor': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('find_course_more' in response.content)
+        response = self.client.get('/find_course/', {'q': 'CS', 'limit': 5, 'cursor': response['X-Next-Cursor']})
+        self.assertFalse('find_course_more' in response.content)
+        self.assertFalse('No courses' in response.content)
+
+class BenchmarkSuiteTests(TransactionTestCase):
+    # TestCase turns commits and rollbacks into no-ops, which would hide whether the schedule is rolled back
+
+    def test_smoke(self):
+        from courses.benchmark import bench_suite
+        result = bench_suite(departments=3, courses=12, klasses=30, instructors=6, repeat=1)
+        for name in ("Course.ft_query", "Instructor.hinted_query", "view:course_autocomplete:cold", "view:instructor_autocomplete:warm"):
+            timing = result["timings"][name]
+            self.assertTrue(timing["calls"] > 0 and timing["p50_ms"] <= timing["p99_ms"], (name, timing))
+        json.dumps(result)
+
+    def test_rolled_back(self):
+        from courses.benchmark import bench_suite
+        from courses.models import Subject
+        models = (Department.all, Course.objects, Klass.objects, Instructor.objects, Subject.objects,
+                  Instructor.klasses.through.objects, Instructor.departments.through.objects)
+        counts = lambda: [manager.count() for manager in models]
+        before = counts()
+        # a second run would hit the unique abbreviations of the first one's departments if they were kept
+        for i in range(2):
+            bench_suite(departments=3, courses=12, klasses=30, instructors=6, repeat=1)
+            self.assertEqual(counts(), before)
+
+class KlassSemesterTests(CatalogTestCase):
+    def setUp(self):
+        super(KlassSemesterTests, self).setUp()
+        self.cs61a = self.courses[("COMPSCI", "61A")]
+        for semester in ("sp10", "fa10"):
+            Klass.objects.create(course=self.cs61a, semester=semester, section="1", section_type="LEC", section_note="", website="", newsgroup="")
+
+    def test_ft_query_joins(self):
+        klasses = Klass.objects.ft_query("CS 61", "fa09")
+        self.assertFalse("IN (SELECT" in str(klasses.query).upper())
+        self.assertEqual(sorted([klass.course.coursenumber for klass in klasses]), ["61A", "61A", "61B", "61B"])
+
+    def test_history(self):
+        history = []
+        self.assertNumQueries(2, lambda: history.extend(Klass.objects.history(self.cs61a)))
+        self.assertEqual(len(history), 3)
+        self.assertEqual([len(klasses) for semester, klasses in history], [2, 1, 1])
+        self.assertEqual(Klass.objects.for_courses([self.cs61a], "sp10", "fa10").count(), 2)
+        # ordered on courses_klass.course_id, as the index is, not on the course's own ordering
+        self.assertFalse("JOIN" in str(Klass.objects.for_courses([self.cs61a]).query).upper())
+
+    def test_by_department(self):
+        groups = []
+        self.assertNumQueries(2, lambda: groups.extend(Klass.objects.by_department("fa09")))
+        self.assertEqual([abbr for abbr, klasses in groups], ["COMPSCI", "EL ENG", "MATH"])
+        self.assertEqual([klass.course.coursenumber for klass in groups[0][1]], ["61A", "61A", "61B", "61B"])
+
+class InstrumentTests(TestCase):
+    def test_histogram(self):
+        from courses.instrument import Histogram
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 3, 50):
+            histogram.add(value)
+        stats = histogram.as_dict()
+        self.assertEqual(stats["buckets"], [["<=1", 2], ["<=10", 1], [">10", 1]])
+        self.assertEqual((stats["count"], stats["max"]), (4, 50))
+
+    def test_disabled(self):
+        from django.core.exceptions import MiddlewareNotUsed
+        from courses import instrument
+        enabled = instrument.ENABLED
+        instrument.ENABLED = False
+        try:
+            self.assertRaises(MiddlewareNotUsed, instrument.InstrumentMiddleware)
+        finally:
+            instrument.ENABLED = enabled
+
+class InstrumentMiddlewareTests(CatalogTestCase):
+    urls = 'courses.urls'
+
+    def setUp(self):
+        from courses import instrument
+        super(InstrumentMiddlewareTests, self).setUp()
+        self.enabled = instrument.ENABLED
+        instrument.ENABLED = True
+        instrument.reset_stats()
+
+    def tearDown(self):
+        from courses import instrument
+        instrument.ENABLED = self.enabled
+        instrument.reset_stats()
+
+    def test_streamed_response(self):
+        from django.test.client import RequestFactory
+        from courses import instrument, views
+        middleware = instrument.InstrumentMiddleware()
+        request = RequestFactory().get('/coursenumber_autocomplete/', {'q': '61', 'department_query': 'CS'})
+        middleware.process_request(request)
+        response = middleware.process_response(request, views.coursenumber_autocomplete(request))
+        self.assertEqual(response.content.count('\n'), 2)
+        # the department lookup, and the courses read by the response's iterator
+        sql_count = instrument.get_stats()["course-coursenumber-autocomplete"]["sql_count"]
+        self.assertEqual((sql_count["count"], sql_count["max"]), (1, 2))
@@ -9,5 +9,7 @@ urlpatterns = patterns('',
         url(r'^minor_autocomplete/$', 'courses.views.subject_autocomplete', {'major' : False}, name="course-minor-autocomplete"),
         url(r'^coursenumber_autocomplete/$', 'courses.views.coursenumber_autocomplete', name="course-coursenumber-autocomplete"),              
         url(r'^instructor_autocomplete/$', 'courses.instructor.instructor_autocomplete', name="course-instructor-autocomplete"), 
+        url(r'^catalog_bundle/$', 'courses.views.catalog_bundle', name="course-catalog-bundle"),
+        url(r'^instrument_stats/$', 'courses.views.instrument_stats', name="course-instrument-stats"),
         url(r'^department-abbreviations/$', 'courses.views.department_abbreviations', name="course-department-abbreviations"),
     )                        
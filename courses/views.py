@@ -1,25 +1,62 @@
-from django.http import HttpResponse
+import json
+
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, HttpResponseForbidden, Http404
+from django.conf import settings
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
 from django.db.models.query import Q
 
 from courses.models import *
+from courses.search import get_search_backend
+from courses.bundle import get_catalog_bundle, bundle_version, bundle_etag
+from courses.conditional import catalog_conditional, etag_matches
+from courses import instrument
+from courses.slowlog import slow_query_threshold, get_slow_queries, reset_slow_queries
+from courses.memoize import memoize_stats
 
 from ajaxlist import get_list_context, filter_objects
 
 from string import atoi
 
+@catalog_conditional('course-find-course', vary=('Cookie',))
 def find_course(request):
+    if request.GET.has_key('cursor'):
+        return find_course_after(request)
     list_context = get_list_context(request, default_sort = "department_abbr", default_max = "20")
     query_function = lambda objects, query: objects.ft_query(query)
     courses = filter_objects(Course, list_context, query_objects = query_function)
     return render_to_response("course/ajax/find_course.html", {"courses" : courses}, context_instance = RequestContext(request))
+
+def find_course_after(request):
+    """
+    find_course with keyset pagination: the courses matching q after cursor (empty for the first page), with a
+    "load more" link carrying the next cursor, which is also sent in the X-Next-Cursor header
+    """
+    q = request.GET.get('q', '')
+    cursor = request.GET.get('cursor')
+    limit = request.GET.get('limit', 20)
+    try:
+        limit = int(limit)
+    except ValueError:
+        return HttpResponseBadRequest()
+    if limit < 1:
+        return HttpResponseBadRequest()
+    try:
+        courses, next_cursor = Course.objects.ft_query_after(q, limit, cursor)
+    except ValueError:
+        return HttpResponseBadRequest()
+    response = render_to_response("course/ajax/find_course.html",
+                                  {"courses" : courses, "query" : q, "continued" : bool(cursor), "next_cursor" : next_cursor},
+                                  context_instance = RequestContext(request))
+    if next_cursor:
+        response['X-Next-Cursor'] = next_cursor
+    return response
     
+@catalog_conditional('course-course-autocomplete', depends=('course', 'department'))
 def course_autocomplete(request):
     def iter_results(courses):
-        if courses:
-            for r in courses:
-                yield '%s|%s\n' % (r.short_name(space = True), r.id)
+        for department_abbr, coursenumber, id in courses:
+            yield '%s|%s\n' % (Course.format_short_name(department_abbr, coursenumber, space = True), id)
     
     if not request.GET.get('q'):
         return HttpResponse(mimetype='text/plain')
@@ -31,14 +68,28 @@ def course_autocomplete(request):
     except ValueError:
         return HttpResponseBadRequest() 
 
-    courses = Course.objects.ft_query(q)[:limit]
-    return HttpResponse(iter_results(courses), mimetype='text/plain')
+    if request.GET.has_key('cursor'):
+        # keyset pages, starting with an empty cursor; the next cursor is in the X-Next-Cursor header
+        if limit < 1:
+            return HttpResponseBadRequest()
+        try:
+            courses, next_cursor = Course.objects.ft_query_after(q, limit, request.GET.get('cursor'),
+                                                                 fields=('department_abbr', 'coursenumber', 'id'))
+        except ValueError:
+            return HttpResponseBadRequest()
+    else:
+        courses = Course.objects.cached_ft_query(q, limit)
+        next_cursor = None
+    response = HttpResponse(iter_results(courses), mimetype='text/plain')
+    if next_cursor:
+        response['X-Next-Cursor'] = next_cursor
+    return response
 
+@catalog_conditional('course-department-autocomplete', depends=('department',))
 def department_autocomplete(request):
     def iter_results(departments):
-        if departments:
-            for r in departments:
-                yield '%s|%s\n' % (r.name, r.pk)
+        for name, id in departments:
+            yield '%s|%s\n' % (name, id)
     
     if not request.GET.get('q'):
         return HttpResponse(mimetype='text/plain')
@@ -50,20 +101,18 @@ def department_autocomplete(request):
     except ValueError:
         return HttpResponseBadRequest() 
 
-    depts = Department.objects.ft_query(q)
-    if depts.count() == 0:
-        depts = Department.objects.ft_query_name_fuzzy(q)
+    depts = Department.objects.cached_autocomplete(q)
     return HttpResponse(iter_results(depts), mimetype='text/plain')
 
+@catalog_conditional('course-subject-autocomplete', depends=('subject',))
 def subject_autocomplete(request, major=None):
     def iter_results(subjects):
-        if subjects:
-            if major is None:
-                for r in subjects:
-                    yield '%s|%s\n' % (unicode(r), r.pk)
-            else:
-                for r in subjects:
-                    yield '%s|%s\n' % (r.name, r.pk)
+        if major is None:
+            for name, subject_major, id in subjects:
+                yield '%s|%s\n' % (Subject.format_name(name, subject_major), id)
+        else:
+            for name, subject_major, id in subjects:
+                yield '%s|%s\n' % (name, id)
     
     if not request.GET.get('q'):
         return HttpResponse(mimetype='text/plain')
@@ -76,21 +125,22 @@ def subject_autocomplete(request, major=None):
         return HttpResponseBadRequest() 
 
     if major is None:
-        subjects = Subject.objects.filter(name__icontains=q)[:limit]
+        subjects = Subject.objects.all()
     else:
-        subjects = Subject.objects.filter(major=major).filter(name__icontains=q)[:limit]
+        subjects = Subject.objects.filter(major=major)
+    subjects = get_search_backend().rank(subjects, 'name', q, limit, values=('name', 'major', 'id'))
     return HttpResponse(iter_results(subjects), mimetype='text/plain')
 
+@catalog_conditional('course-coursenumber-autocomplete', depends=('course', 'department'))
 def coursenumber_autocomplete(request):
     dept_abbrs = request.GET.get('abbrs', False)
     def iter_results(courses):
-        if courses:
-            if dept_abbrs:
-                for r in courses:
-                    yield '%s: %s|%s,,%s\n' % (r.coursenumber, r.name, r.short_name(space=True), r.id)
-            else:
-                for r in courses:
-                    yield '%s|%s\n' % (r.coursenumber, r.id)
+        if dept_abbrs:
+            for coursenumber, name, department_abbr, id in courses:
+                yield '%s: %s|%s,,%s\n' % (coursenumber, name, Course.format_short_name(department_abbr, coursenumber, space=True), id)
+        else:
+            for coursenumber, name, department_abbr, id in courses:
+                yield '%s|%s\n' % (coursenumber, id)
     
     if not (request.GET.has_key('q') and request.GET.has_key("department_query")) :
         return HttpResponse(mimetype='text/plain')
@@ -101,16 +151,57 @@ def coursenumber_autocomplete(request):
         limit = int(limit)
     except ValueError:
         return HttpResponseBadRequest() 
+    if limit < 1:
+        return HttpResponseBadRequest()
 
     dq = request.GET.get("department_query")
-    depts = Department.objects.ft_query_name(dq)
-    if depts.count() == 0:
-        depts = Department.objects.ft_query(dq)
-    courses = Course.objects.filter(department__in = depts).query_coursenumber(q)
+    # one lookup for both the name and the abbreviation; a name match wins, as it did when they were separate queries
+    depts = list(Department.objects.filter(Q(search_name = normalize_search(dq)) | Q(abbr = Department.get_proper_abbr(dq))).values_list('id', 'name'))
+    dept_ids = [id for id, name in depts if normalize_search(name) == normalize_search(dq)] or [id for id, name in depts]
+    if not dept_ids:
+        return HttpResponse(mimetype='text/plain')
+    courses = Course.objects.filter(department__in = dept_ids).query_coursenumber(q)
+    courses = courses.values_list('coursenumber', 'name', 'department_abbr', 'id')[:limit]
 
-    return HttpResponse(iter_results(courses), mimetype='text/plain')
+    return HttpResponse(iter_results(courses.iterator()), mimetype='text/plain')
 
+BUNDLE_MAX_AGE = getattr(settings, 'COURSES_BUNDLE_MAX_AGE', 60 * 5)
+# a year, for the URLs naming a version
+BUNDLE_VERSIONED_MAX_AGE = 60 * 60 * 24 * 365
+
+def catalog_bundle(request):
+    """ The catalog bundle of courses.bundle, which the local autocomplete widgets filter in the browser """
+    version = bundle_version()
+    etag = bundle_etag(version)
+    if request.GET.get('v') == version:
+        max_age = BUNDLE_VERSIONED_MAX_AGE
+    else:
+        max_age = BUNDLE_MAX_AGE
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(get_catalog_bundle(version), mimetype='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=%d' % max_age
+    return response
+
+@catalog_conditional('course-department-abbreviations', depends=('department',), vary=('Cookie',))
 def department_abbreviations(request):
     departments = Department.objects.order_by('name')
     return render_to_response("course/department_abbreviations.html", {"departments" : departments}, context_instance=RequestContext(request))
 
+
+def instrument_stats(request):
+    """
+    The histograms of courses.instrument, the slow queries of courses.slowlog and the memoize stats as JSON, for
+    staff; POST resets the histograms and the slow queries
+    """
+    if not instrument.ENABLED and slow_query_threshold() is None:
+        raise Http404
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    if request.method == 'POST':
+        instrument.reset_stats()
+        reset_slow_queries()
+    stats = {"urls": instrument.get_stats(), "slow_queries": get_slow_queries(), "memoize": memoize_stats()}
+    return HttpResponse(json.dumps(stats, indent=2, sort_keys=True), mimetype='application/json')
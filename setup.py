@@ -17,10 +17,11 @@ setup(
         'Programming Language :: Python',
         'Framework :: Django',
     ],
-    install_requires=['setuptools', 'BeautifulSoup'],
+    install_requires=['setuptools', 'BeautifulSoup', 'Django>=1.4,<1.5'],
     package_data = {
         'courses': [
             'fixtures/*.json',
+            'sql/*.sql',
         ],
     },
     zip_safe=False,